@@ -0,0 +1,106 @@
+"""Lightweight stand-ins for the discord.py objects the hot paths touch.
+
+They carry only the attributes the bot's utilities read (ids, names, roles,
+members), so synthetic guilds of any size can be built without a gateway."""
+import random
+
+
+class FakeRole:
+
+	def __init__(self, role_id, name, guild):
+		self.id = role_id
+		self.name = name
+		self.guild = guild
+		self.members = []
+
+	def is_default(self):
+		return self.id == self.guild.id
+
+
+class FakeMember:
+
+	def __init__(self, member_id, guild, bot=False):
+		self.id = member_id
+		self.name = f'member{member_id}'
+		self.discriminator = f'{member_id % 10000:04d}'
+		self.guild = guild
+		self.bot = bot
+		self.roles = []
+		self.dms = []
+
+	async def send(self, content=None, **kwargs):
+		self.dms.append(content)
+
+	def __str__(self):
+		return f'{self.name}#{self.discriminator}'
+
+
+class FakeChannel:
+
+	def __init__(self, channel_id, guild):
+		self.id = channel_id
+		self.guild = guild
+
+
+class FakeMessage:
+
+	def __init__(self, message_id, author, channel, content):
+		self.id = message_id
+		self.author = author
+		self.channel = channel
+		self.guild = channel.guild
+		self.content = content
+		self.mentions = []
+		self.deleted = False
+		# Connection state, commands.Context copies it from the message
+		self._state = None
+
+	async def delete(self):
+		self.deleted = True
+
+
+class FakeGuild:
+
+	def __init__(self, guild_id, name):
+		self.id = guild_id
+		self.name = name
+		self.members = []
+		# Like discord.py, the @everyone role shares the guild's id and comes first
+		self.roles = [FakeRole(guild_id, '@everyone', self)]
+		self.channels = []
+		self._roles = {guild_id: self.roles[0]}
+
+	def get_role(self, role_id):
+		return self._roles.get(role_id)
+
+	def add_role(self, role_id, name):
+		role = FakeRole(role_id, name, self)
+		self.roles.append(role)
+		self._roles[role_id] = role
+		return role
+
+	def add_member(self, member_id, roles, bot=False):
+		member = FakeMember(member_id, self, bot)
+		member.roles = [self.roles[0]] + roles
+		for role in member.roles:
+			role.members.append(member)
+		self.members.append(member)
+		return member
+
+
+def synthetic_guild(guild_id, members=1000, roles=50, role_density=0.1, unverified=0.05, seed=0):
+	"""A guild whose members each hold about role_density * roles random roles. The first
+	role plays the verification role and is held by the unverified fraction of members"""
+	rng = random.Random(seed)
+	guild = FakeGuild(guild_id, f'guild{guild_id}')
+	guild.channels.append(FakeChannel(guild_id + 1, guild))
+	verification_role = guild.add_role(guild_id + 2, 'Unverified')
+	other_roles = [guild.add_role(guild_id + 3 + i, f'role{i}') for i in range(roles - 1)]
+	mean = role_density * len(other_roles)
+	for i in range(members):
+		held = min(len(other_roles), max(0, round(rng.gauss(mean, mean ** 0.5))))
+		member_roles = rng.sample(other_roles, held)
+		if rng.random() < unverified:
+			member_roles.append(verification_role)
+		guild.add_member(guild_id * 1000000 + i, member_roles, bot=rng.random() < 0.01)
+	return guild
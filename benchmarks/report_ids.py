@@ -0,0 +1,66 @@
+"""Stress test of report id allocation.
+
+Fires many concurrent report creations (and some recalls) at a fresh report store
+and checks that every report was stored under its own id and no id was ever handed
+out twice. Run with: python -m benchmarks.report_ids [reports] [guilds]"""
+import asyncio
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from utils.report_store import ReportStore
+
+
+def report(number):
+	return {
+		"action": "Ban",
+		"body": f"stress report {number}",
+		"issuer_id": 1,
+		"issuer": "issuer#0001",
+		"subject_id": 1000 + number,
+		"subject": f"subject{number}#0001"
+	}
+
+
+async def stress(store, reports, guilds):
+	async def create(number):
+		guild_id = number % guilds
+		report_id = await store.add(guild_id, report(number))
+		# Recall every tenth report straight away, its id must not be handed out again
+		if number % 10 == 0:
+			await store.delete(guild_id, report_id)
+		return guild_id, report_id
+
+	start = perf_counter()
+	allocated = await asyncio.gather(*[create(number) for number in range(reports)])
+	elapsed = perf_counter() - start
+
+	recalled = sum(1 for number in range(reports) if number % 10 == 0)
+	stored = store.db.execute('SELECT COUNT(*) FROM reports').fetchone()[0]
+	unique = len(set(allocated))
+	per_guild_ok = all(
+		sorted(report_id for guild, report_id in allocated if guild == guild_id)
+		== list(range(1, sum(1 for guild, _ in allocated if guild == guild_id) + 1))
+		for guild_id in range(guilds)
+	)
+	print(f'{reports} reports over {guilds} guilds in {elapsed:.3f}s ({reports / elapsed:.0f} reports/s)')
+	print(f'unique ids: {unique}/{reports}, stored: {stored} (expected {reports - recalled})')
+	print(f'ids consecutive per guild: {per_guild_ok}')
+	return unique == reports and stored == reports - recalled and per_guild_ok
+
+
+def main():
+	reports = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	guilds = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+	with tempfile.TemporaryDirectory() as directory:
+		store = ReportStore(os.path.join(directory, 'reports.db'))
+		try:
+			ok = asyncio.run(stress(store, reports, guilds))
+		finally:
+			store.close()
+	sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,208 @@
+"""Offline benchmarks of the bot's hot paths on synthetic guilds.
+
+Drives the message gate, the role statistics behind b!networkplot, report
+lookups and report persistence directly, without touching the network, and
+reports throughput and latency percentiles. Results are saved as JSON so runs
+on different commits can be compared.
+
+Run with: python -m benchmarks.run [--members N] [--roles N] [--density F] [--reports N]
+[--label NAME] [--compare results.json]"""
+import argparse
+import asyncio
+from datetime import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+from time import perf_counter_ns
+
+from benchmarks.fakes import FakeMessage, synthetic_guild
+from utils.config_store import ConfigStore
+from utils.report_store import ReportStore
+from utils.role_stats import RoleStatsIndex
+from utils.unverified_gate import UnverifiedGate
+
+try:
+	from utils.cooccurrence import cooccurrence_from_counts, graph_data
+except ImportError:
+	# numpy/scipy are only needed by the worker processes, skip the role benchmarks without them
+	cooccurrence_from_counts = graph_data = None
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def summary(samples):
+	"""Throughput and latency percentiles (in microseconds) of per operation timings in nanoseconds"""
+	samples = sorted(samples)
+	total = sum(samples)
+
+	def percentile(fraction):
+		return samples[min(len(samples) - 1, int(fraction * len(samples)))] / 1000
+
+	return {
+		"operations": len(samples),
+		"seconds": total / 1e9,
+		"per_second": len(samples) / (total / 1e9) if total else float('inf'),
+		"p50_us": percentile(0.5),
+		"p95_us": percentile(0.95),
+		"p99_us": percentile(0.99),
+		"max_us": samples[-1] / 1000
+	}
+
+
+def measure(function, arguments):
+	samples = []
+	for args in arguments:
+		start = perf_counter_ns()
+		function(*args)
+		samples.append(perf_counter_ns() - start)
+	return summary(samples)
+
+
+async def measure_async(function, arguments):
+	samples = []
+	for args in arguments:
+		start = perf_counter_ns()
+		await function(*args)
+		samples.append(perf_counter_ns() - start)
+	return summary(samples)
+
+
+def report(number, guild, rng):
+	issuer, subject = rng.choice(guild.members), rng.choice(guild.members)
+	return {
+		"action": rng.choice(['Ban', 'Kick', 'Warning']),
+		"body": f'benchmark report {number}',
+		"issuer_id": issuer.id,
+		"issuer": str(issuer),
+		"subject_id": subject.id,
+		"subject": str(subject)
+	}
+
+
+def run(options, directory):
+	rng = random.Random(options.seed)
+	guilds = [
+		synthetic_guild(
+			(i + 1) * 10 ** 9, options.members, options.roles, options.density, options.unverified, options.seed + i)
+		for i in range(options.guilds)
+	]
+	results = {}
+
+	# Message gate
+	config_path = os.path.join(directory, 'config.json')
+	with open(config_path, 'w') as file:
+		json.dump({}, file)
+	store = ConfigStore(config_path)
+	for guild in guilds:
+		store.update(guild.id, verification_channel=guild.channels[0].id, verification_role=guild.roles[1].id)
+	gate = UnverifiedGate(store)
+	for guild in guilds:
+		gate.build(guild)
+	messages = []
+	for i in range(options.messages):
+		guild = rng.choice(guilds)
+		messages.append((FakeMessage(i, rng.choice(guild.members), guild.channels[0], 'hello'),))
+	# The bot's own user never posts in these guilds
+	results["gate_message"] = measure(lambda message: gate.blocks(message, None), messages)
+
+	# Role statistics and the co-occurrence data behind b!networkplot
+	if cooccurrence_from_counts is not None:
+		index = RoleStatsIndex()
+		results["role_stats_build"] = asyncio.run(
+			measure_async(index.build, [(guild,) for guild in guilds] * options.builds))
+		inputs = []
+		for guild in guilds:
+			roles = [role for role in guild.roles if not role.is_default()]
+			inputs.append((index.guilds[guild.id], [role.id for role in roles], [role.name for role in roles]))
+		results["role_co_occurrence"] = measure(
+			lambda stats, role_ids, names: stats.co_occurrence(role_ids), inputs * options.builds)
+		plot_inputs = [(stats.co_occurrence(role_ids), names) for stats, role_ids, names in inputs]
+		results["cooccurrence_graph"] = measure(
+			lambda data, names: graph_data(cooccurrence_from_counts(*data), names), plot_inputs * options.builds)
+
+	# Report persistence and lookups
+	reports = ReportStore(os.path.join(directory, 'reports.db'))
+	try:
+		additions = []
+		for i in range(options.reports):
+			guild = rng.choice(guilds)
+			additions.append((guild.id, report(i, guild, rng)))
+		results["report_add"] = asyncio.run(measure_async(reports.add, additions))
+
+		sample = rng.sample(additions, min(len(additions), options.lookups))
+		lookups = [(guild_id, report["subject_id"]) for guild_id, report in sample]
+		results["lookup_by_user"] = measure(
+			lambda guild_id, user_id: (
+				reports.count_by_user(guild_id, user_id), reports.by_user(guild_id, user_id, limit=10)),
+			lookups)
+		results["lookup_by_id"] = measure(
+			reports.get, [(guild_id, report["report_id"]) for guild_id, report in sample])
+	finally:
+		reports.close()
+	return results
+
+
+def git_revision():
+	try:
+		return subprocess.run(
+			['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def print_results(results, baseline=None):
+	print(f'{"benchmark":<22}{"ops":>8}{"ops/s":>12}{"p50 us":>10}{"p95 us":>10}{"p99 us":>10}{"max us":>10}')
+	for name, result in results.items():
+		line = f'{name:<22}{result["operations"]:>8}{result["per_second"]:>12.0f}{result["p50_us"]:>10.1f}' \
+			f'{result["p95_us"]:>10.1f}{result["p99_us"]:>10.1f}{result["max_us"]:>10.1f}'
+		if baseline is not None and name in baseline:
+			change = result["p50_us"] / baseline[name]["p50_us"] - 1 if baseline[name]["p50_us"] else 0
+			line += f'   p50 {change:+.1%} vs baseline'
+		print(line)
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+	parser.add_argument('--members', type=int, default=5000, help='members per guild')
+	parser.add_argument('--roles', type=int, default=100, help='roles per guild')
+	parser.add_argument('--density', type=float, default=0.05, help='fraction of the roles an average member holds')
+	parser.add_argument('--unverified', type=float, default=0.05, help='fraction of members awaiting verification')
+	parser.add_argument('--guilds', type=int, default=4)
+	parser.add_argument('--messages', type=int, default=100000, help='messages pushed through the gate')
+	parser.add_argument('--builds', type=int, default=5, help='repetitions of the per guild role benchmarks')
+	parser.add_argument('--reports', type=int, default=2000, help='reports stored')
+	parser.add_argument('--lookups', type=int, default=1000, help='reports looked up')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--label', help='name of the results file, defaults to the current git revision')
+	parser.add_argument('--compare', help='results file of an earlier run to compare against')
+	options = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		results = run(options, directory)
+
+	baseline = None
+	if options.compare:
+		with open(options.compare) as file:
+			baseline = json.load(file)["results"]
+	print_results(results, baseline)
+
+	revision = git_revision()
+	label = options.label or revision or datetime.utcnow().strftime('%Y%m%d%H%M%S')
+	os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+	path = os.path.join(RESULTS_DIRECTORY, f'{label}.json')
+	with open(path, 'w') as file:
+		json.dump({
+			"revision": revision,
+			"created_at": datetime.utcnow().isoformat(),
+			"python": platform.python_version(),
+			"parameters": {key: value for key, value in vars(options).items() if key not in ('label', 'compare')},
+			"results": results
+		}, file, indent=2, separators=(',', ': '))
+	print(f'Results saved to {path}')
+
+
+if __name__ == '__main__':
+	main()
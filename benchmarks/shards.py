@@ -0,0 +1,206 @@
+"""Smoke test of several shard processes sharing config.json and reports.db.
+
+Every process imports main.py with BOT_SHARD_IDS/BOT_SHARD_COUNT set the way
+launcher.py sets them, opens the stores like main.py does at startup and feeds
+the bot's own event handlers (on_guild_join, on_message, on_guild_remove) fake
+guild events for the guilds its shards own. The processes start from a
+config.json that still holds legacy reports and come up at staggered times.
+Afterwards every guild must have been handled by exactly one shard process and
+the merged files must hold exactly what every shard wrote.
+Run with: python -m benchmarks.shards [processes] [shards] [guilds] [rounds]"""
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from benchmarks.fakes import FakeChannel, FakeMember, FakeMessage, synthetic_guild
+from launcher import shard_ranges
+from utils.report_store import ReportStore
+
+LEGACY_REPORTS = 2
+STARTUP_DELAY = 0.3
+GUILD_MEMBERS = 20
+
+
+def shard_of(guild_id, shards):
+	# Discord's sharding formula
+	return (guild_id >> 22) % shards
+
+
+def guild_ids(guilds):
+	return [(number << 22) + number for number in range(1, guilds + 1)]
+
+
+def removed(guild_id):
+	# Every fifth guild removes the bot at the end
+	return guild_id % 5 == 0
+
+
+def fake_guild(guild_id):
+	# Verification channel is guild_id + 1 and the verification role guild_id + 2, as in legacy_config
+	return synthetic_guild(guild_id, members=GUILD_MEMBERS, roles=5, unverified=0.3, seed=guild_id)
+
+
+def legacy_config(guilds):
+	config = {"token": "not-a-token"}
+	for guild_id in guild_ids(guilds):
+		config[str(guild_id)] = {
+			"verification_channel": guild_id + 1,
+			"verification_role": guild_id + 2,
+			"reporting_channel": None,
+			"reports": {
+				str(number): {
+					"report_id": number, "action": "Warning", "body": "legacy", "issuer": "mod#0001",
+					"subject": "user#0001"
+				}
+				for number in range(1, LEGACY_REPORTS + 1)
+			}
+		}
+	return config
+
+
+async def gateway(main, guilds, rounds, delay):
+	"""Play the gateway for the guilds on this process' shards, return what the handlers did"""
+	bot = main.bot
+	# Processes come up at different times, the later ones migrate after the others are running
+	await asyncio.sleep(delay)
+	main.open_stores('config.json', 'reports.db')
+	bot.config_store.flush_delay = 0.01
+	handled = {}
+	try:
+		owned = [fake_guild(guild_id) for guild_id in guild_ids(guilds)
+			if shard_of(guild_id, bot.shard_count) in bot.shard_ids]
+		for guild in owned:
+			await main.on_guild_join(guild)
+			handled[guild.id] = {"deleted": 0, "notices": 0}
+		for number in range(rounds):
+			for guild in owned:
+				general = FakeChannel(guild.id + 100, guild)
+				for member in guild.members:
+					message = FakeMessage(number, member, general, f'round {number}')
+					await main.on_message(message)
+					handled[guild.id]["deleted"] += message.deleted
+				bot.config_store.update(guild.id, reporting_channel=number)
+				await bot.report_store.add(guild.id, {
+					"action": "Kick", "body": f'round {number}', "issuer_id": 1, "issuer": "mod#0001",
+					"subject_id": 2, "subject": "user#0001"
+				})
+			await asyncio.sleep(0.005)
+		for guild in owned:
+			handled[guild.id]["notices"] = sum(len(member.dms) for member in guild.members)
+			if removed(guild.id):
+				await main.on_guild_remove(guild)
+		# Let the last batch go out, then write whatever is left
+		await asyncio.sleep(bot.config_store.flush_delay)
+		await bot.config_store.flush()
+	finally:
+		bot.report_store.close()
+	return handled
+
+
+def run_shards(directory, shard_range, shards, guilds, rounds, delay):
+	# Same environment launcher.py hands to every main.py process
+	os.environ['BOT_SHARD_COUNT'] = str(shards)
+	os.environ['BOT_SHARD_IDS'] = ','.join(map(str, shard_range))
+	main = importlib.import_module('main')
+	os.chdir(directory)
+	main.bot._connection.user = FakeMember(1, None, bot=True)
+	handled = main.bot.loop.run_until_complete(gateway(main, guilds, rounds, delay))
+	result = {"shard_count": main.bot.shard_count, "shard_ids": main.bot.shard_ids, "guilds": handled}
+	with open(f'shards-{shard_range[0]}.json', 'w') as file:
+		json.dump(result, file)
+
+
+def expected_deletions(guild_id, rounds):
+	# Every member holding the verification role gets each message outside the verification channel deleted
+	return len(fake_guild(guild_id).get_role(guild_id + 2).members) * rounds
+
+
+def check(directory, shards, processes, guilds, rounds):
+	problems = []
+	handled_by = {}
+	for shard_range in shard_ranges(processes, shards):
+		try:
+			with open(os.path.join(directory, f'shards-{shard_range[0]}.json')) as file:
+				result = json.load(file)
+		except FileNotFoundError:
+			problems.append(f'shards {shard_range}: no result')
+			continue
+		if result["shard_count"] != shards or result["shard_ids"] != shard_range:
+			problems.append(f'shards {shard_range}: bot started with {result["shard_ids"]} of {result["shard_count"]}')
+		for guild_id, events in result["guilds"].items():
+			guild_id = int(guild_id)
+			handled_by.setdefault(guild_id, []).append(shard_range)
+			if shard_of(guild_id, shards) not in shard_range:
+				problems.append(f'{guild_id}: handled by shards {shard_range}')
+			unverified = expected_deletions(guild_id, 1)
+			if events["deleted"] != unverified * rounds or events["notices"] != unverified:
+				problems.append(f'{guild_id}: {events} for {unverified} unverified members')
+
+	with open(os.path.join(directory, 'config.json')) as file:
+		config = json.load(file)
+	if config.get("token") != "not-a-token":
+		problems.append('token lost')
+	reports = ReportStore(os.path.join(directory, 'reports.db'))
+	try:
+		for guild_id in guild_ids(guilds):
+			if len(handled_by.get(guild_id, [])) != 1:
+				problems.append(f'{guild_id}: handled by shards {handled_by.get(guild_id, [])}')
+			entry = config.get(str(guild_id))
+			if removed(guild_id):
+				if entry is not None:
+					problems.append(f'{guild_id}: removed guild is back')
+			elif entry is None:
+				problems.append(f'{guild_id}: missing')
+			elif entry["reporting_channel"] != rounds - 1 or entry["verification_role"] != guild_id + 2 \
+					or "reports" in entry:
+				problems.append(f'{guild_id}: stale config {entry}')
+			ids = [row[0] for row in reports.db.execute(
+				'SELECT report_id FROM reports WHERE guild_id = ? ORDER BY report_id', (guild_id,))]
+			if ids != list(range(1, LEGACY_REPORTS + rounds + 1)):
+				problems.append(f'{guild_id}: report ids {ids}')
+	finally:
+		reports.close()
+	return problems
+
+
+def smoke_test(processes=4, shards=8, guilds=64, rounds=20):
+	"""Run the shard processes in a temporary directory, return the list of problems found"""
+	with tempfile.TemporaryDirectory() as directory:
+		with open(os.path.join(directory, 'config.json'), 'w') as file:
+			json.dump(legacy_config(guilds), file)
+		# Every process imports main.py fresh with its own shard environment, as launcher.py starts them
+		context = multiprocessing.get_context('spawn')
+		children = [
+			context.Process(
+				target=run_shards, args=(directory, shard_range, shards, guilds, rounds, number * STARTUP_DELAY))
+			for number, shard_range in enumerate(shard_ranges(processes, shards))
+		]
+		for child in children:
+			child.start()
+		for child in children:
+			child.join()
+		problems = [f'shard process exited with {child.exitcode}' for child in children if child.exitcode]
+		return problems + check(directory, shards, processes, guilds, rounds)
+
+
+def main():
+	processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+	shards = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+	guilds = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+	rounds = int(sys.argv[4]) if len(sys.argv) > 4 else 20
+	start = perf_counter()
+	problems = smoke_test(processes, shards, guilds, rounds)
+	print(f'{processes} processes, {shards} shards, {guilds} guilds, {rounds} rounds in {perf_counter() - start:.3f}s')
+	for problem in problems:
+		print(problem)
+	print('ok' if not problems else f'{len(problems)} problems')
+	sys.exit(0 if not problems else 1)
+
+
+if __name__ == '__main__':
+	main()
@@ -1,5 +1,3 @@
-import json
-
 from discord.utils import get
 from discord.ext import commands
 
@@ -8,22 +6,33 @@ class Config(commands.Cog):
 
 	def __init__(self, bot):
 		self.bot = bot
-		self.config_full = json.loads(open('config.json').read())
+		self.store = bot.config_store
 
 	@commands.command()
 	@commands.has_permissions(manage_guild=True)
 	async def reporting(self, ctx, state: bool):
 		"""Enable or disable report receipts being sent in a channel"""
-		config = self.config_full[str(ctx.message.guild.id)]
-		if state is True and config["reporting_channel"] is None:
-			channel = await ctx.message.guild.create_text_channel(name="Reporting")
-			config.update(reporting_channel=channel.id)
-			json.dump(self.config_full, open('config.json', 'w'), indent=2, separators=(',', ': '))
-		elif state is False and config["reporting_channel"] is not None:
-			channel = get(ctx.message.guild.text_channels, id=config["reporting_channel"])
-			await channel.delete()
-			config.update(reporting_channel=None)
-			json.dump(self.config_full, open('config.json', 'w'), indent=2, separators=(',', ': '))
+		# Held across the check and the update so two toggles can not both create a channel
+		async with self.bot.scheduler.guild_lock(ctx.message.guild.id):
+			config = self.store.guild(ctx.message.guild.id)
+			if state is True and config["reporting_channel"] is None:
+				channel = await ctx.message.guild.create_text_channel(name="Reporting")
+				self.store.update(ctx.message.guild.id, reporting_channel=channel.id)
+			elif state is False and config["reporting_channel"] is not None:
+				channel = get(ctx.message.guild.text_channels, id=config["reporting_channel"])
+				await channel.delete()
+				self.store.update(ctx.message.guild.id, reporting_channel=None)
+
+	@commands.command()
+	@commands.has_permissions(manage_guild=True)
+	async def lockdown(self, ctx, state: bool):
+		"""Manually start or lift a raid lockdown (welcome messages are suspended while it lasts)"""
+		if state:
+			self.bot.raid_detector.lock(ctx.message.guild.id)
+			await ctx.send('Lockdown enabled')
+		else:
+			self.bot.raid_detector.lift(ctx.message.guild.id)
+			await ctx.send('Lockdown lifted')
 
 
 def setup(bot):
@@ -1,23 +1,192 @@
 from asyncio import sleep
+from datetime import datetime, timedelta
+import gzip
+import json
+import os
+import re
+import shlex
+import tempfile
+from typing import Optional
 
-from discord import Embed, TextChannel, User
+from discord import Embed, File, HTTPException, NotFound, Object, TextChannel, User
 from discord.ext import commands
 
+# Discord accepts at most 10 embeds and 6000 embed characters per message and 100 messages
+# per bulk delete, and refuses to bulk delete messages older than 14 days
+EMBEDS_PER_MESSAGE = 10
+EMBED_CHARACTERS_PER_MESSAGE = 6000
+BULK_DELETE_LIMIT = 100
+BULK_DELETE_MAX_AGE = timedelta(days=14)
+# Edit the progress message every this many sent batches
+PROGRESS_INTERVAL = 10
+# Archives are written one history page (100 messages) at a time and split into parts that
+# stay this far below the server's upload limit, compressed output lags behind by zlib's buffer
+ARCHIVE_PAGE_SIZE = 100
+ARCHIVE_SIZE_MARGIN = 512 * 1024
+
+
+def split_options(options):
+    """Split on whitespace, honouring quotes but not backslash escapes, so regex patterns such as \\d+
+    arrive unchanged"""
+    lexer = shlex.shlex(options, posix=False)
+    lexer.whitespace_split = True
+    try:
+        tokens = list(lexer)
+    except ValueError as error:
+        raise commands.BadArgument(f'Invalid purge options: {error}')
+    # Without POSIX mode the quotes stay part of the token
+    return [token[1:-1] if len(token) > 1 and token[0] == token[-1] and token[0] in '\'"' else token
+            for token in tokens]
+
+
+def parse_purge_filters(options):
+    """Turn purge options into (history bounds, message checks).
+
+    --bots, --attachments, --regex <pattern>, --newer <minutes> and --older <minutes>
+    combine, a message is deleted only if it passes every check. Age limits are
+    applied by the history request itself so the scan stops at the boundary."""
+    bounds = {}
+    checks = []
+    tokens = split_options(options)
+    while tokens:
+        option = tokens.pop(0)
+        if option == '--bots':
+            checks.append(lambda message: message.author.bot)
+        elif option == '--attachments':
+            checks.append(lambda message: bool(message.attachments))
+        elif option in ('--regex', '--newer', '--older') and tokens:
+            value = tokens.pop(0)
+            if option == '--regex':
+                try:
+                    pattern = re.compile(value)
+                except re.error:
+                    raise commands.BadArgument(f'Invalid regex: {value}')
+                checks.append(lambda message, pattern=pattern: pattern.search(message.content) is not None)
+            elif not value.isdigit():
+                raise commands.BadArgument(f'{option} takes a number of minutes')
+            else:
+                cutoff = datetime.utcnow() - timedelta(minutes=int(value))
+                bounds['after' if option == '--newer' else 'before'] = cutoff
+        else:
+            raise commands.BadArgument(f'Unknown purge option: {option}')
+    return bounds, checks
+
+
+def message_embed(message):
+    embed = Embed(description=message.content)
+    embed.set_author(name=message.author.name, icon_url=message.author.avatar_url)
+    embed.timestamp = message.created_at
+    return embed
+
+
+def message_record(message):
+    """Plain JSON representation of a message for archives"""
+    return {
+        "id": message.id,
+        "author": {
+            "id": message.author.id,
+            "name": message.author.name,
+            "discriminator": message.author.discriminator,
+            "bot": message.author.bot
+        },
+        "created_at": message.created_at.isoformat(),
+        "edited_at": message.edited_at.isoformat() if message.edited_at is not None else None,
+        "type": message.type.name,
+        "pinned": message.pinned,
+        "content": message.content,
+        "attachments": [
+            {"filename": attachment.filename, "url": attachment.url, "size": attachment.size}
+            for attachment in message.attachments
+        ],
+        "embeds": [embed.to_dict() for embed in message.embeds]
+    }
+
+
+class ArchivePart:
+    """One gzip compressed JSONL file of a channel archive"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.last_id = None
+        self._raw = open(path, 'wb')
+        self._file = gzip.GzipFile(fileobj=self._raw, mode='wb')
+
+    @property
+    def size(self):
+        # Compressed bytes written so far
+        return self._raw.tell()
+
+    def write(self, records):
+        self._file.write(b''.join(json.dumps(record).encode() + b'\n' for record in records))
+        self.count += len(records)
+        self.last_id = records[-1]["id"]
+
+    def close(self):
+        self._file.close()
+        self._raw.close()
+
+
+async def delete_messages(channel, messages):
+    """Delete messages using bulk deletes of up to 100 where their age allows, one by one otherwise.
+    Rate limits are handled per route bucket by discord.py's HTTP client."""
+    cutoff = datetime.utcnow() - BULK_DELETE_MAX_AGE
+    recent = [message for message in messages if message.created_at > cutoff]
+    old = [message for message in messages if message.created_at <= cutoff]
+    for start in range(0, len(recent), BULK_DELETE_LIMIT):
+        # delete_messages falls back to a single delete for batches of one
+        await channel.delete_messages(recent[start:start + BULK_DELETE_LIMIT])
+    for message in old:
+        try:
+            # Works for plain Objects as well as full messages
+            await channel.delete_messages([message])
+        except NotFound:
+            pass
+
 
 class Messages(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.store = bot.config_store
 
     @commands.command()
     @commands.has_permissions(manage_messages=True)
-    async def purge(self, ctx, limit: int, target: User = None):
-        """Remove the specified amount of messages"""
+    @commands.max_concurrency(1, per=commands.BucketType.channel)
+    async def purge(self, ctx, limit: int, target: Optional[User] = None, *, options: str = ''):
+        """Remove the specified amount of messages, optionally only those from target and matching
+        the options: --bots, --attachments, --regex <pattern>, --newer <minutes>, --older <minutes>"""
         await ctx.message.delete()
-        if target is None:
-            await ctx.message.channel.purge(limit=limit)
-        else:
-            await ctx.message.channel.purge(limit=limit, check=lambda message: message.author == target)
+        if limit < 1:
+            raise commands.BadArgument('The amount of messages to purge must be at least 1')
+        bounds, checks = parse_purge_filters(options)
+        if target is not None:
+            checks.insert(0, lambda message: message.author.id == target.id)
+
+        async with self.bot.scheduler.heavy(ctx.guild.id):
+            channel = ctx.message.channel
+            progress = await ctx.send('Purging messages: 0 deleted')
+            before = bounds.get('before')
+            # Never touch the progress message itself
+            if before is None or before > progress.created_at:
+                before = progress
+            matched = []
+            deleted = scanned = 0
+            history = channel.history(limit=None, before=before, after=bounds.get('after'), oldest_first=False)
+            async for message in history:
+                scanned += 1
+                if all(check(message) for check in checks):
+                    matched.append(message)
+                    if deleted + len(matched) >= limit or len(matched) == BULK_DELETE_LIMIT:
+                        await delete_messages(channel, matched)
+                        deleted += len(matched)
+                        matched = []
+                        await progress.edit(content=f'Purging messages: {deleted} deleted, {scanned} scanned')
+                        if deleted >= limit:
+                            break
+            await delete_messages(channel, matched)
+            deleted += len(matched)
+            await progress.edit(content=f'Purge complete: {deleted} messages deleted, {scanned} scanned')
 
     @purge.error
     async def purge_error(self, ctx, error):
@@ -26,25 +195,241 @@ class Messages(commands.Cog):
             message = await ctx.send("You are missing the manage messages permission!")
             await sleep(3)
             await message.delete()
+        elif isinstance(getattr(error, 'original', error), commands.BadArgument):
+            message = await ctx.send(str(getattr(error, 'original', error)))
+            await sleep(3)
+            await message.delete()
+
+    def move_checkpoints(self, guild):
+        return self.store.guild(guild.id).setdefault("move_checkpoints", {})
+
+    def save_move_checkpoint(self, channel, checkpoint):
+        checkpoints = self.move_checkpoints(channel.guild)
+        if checkpoint is None:
+            checkpoints.pop(str(channel.id), None)
+        else:
+            checkpoints[str(channel.id)] = checkpoint
+        self.store.mark_dirty(channel.guild.id)
 
     @commands.command()
     @commands.has_permissions(manage_messages=True)
+    @commands.max_concurrency(1, per=commands.BucketType.channel)
     async def move(self, ctx, count: int, target: TextChannel, copy: bool = False):
         """Move/copy specified amount of messages to target channel"""
         await ctx.message.delete()
-        messages = []
-        async for message in ctx.message.channel.history(limit=count):
-            embed = Embed(description=message.content)
-            embed.set_author(name=message.author.name, icon_url=message.author.avatar_url)
-            embed.timestamp = message.created_at
-            messages.append(embed)
-            if not copy:
-                await message.delete()
-
-        await target.send(f'Moved from {ctx.message.channel.mention}:')
-
-        for embed in reversed(messages):
-            await target.send(embed=embed)
+        async with self.bot.scheduler.heavy(ctx.guild.id):
+            # Only the boundaries of the window are kept so the messages can be streamed oldest first
+            newest = oldest = None
+            async for message in ctx.message.channel.history(limit=count):
+                newest = newest or message
+                oldest = message
+            if oldest is None:
+                return
+
+            checkpoint = {
+                "target": target.id,
+                "copy": copy,
+                "after": oldest.id - 1,
+                "before": newest.id + 1,
+                "remaining": count,
+                "moved": 0,
+                "pending_delete": []
+            }
+            self.save_move_checkpoint(ctx.message.channel, checkpoint)
+            await target.send(f'Moved from {ctx.message.channel.mention}:')
+            await self.run_move(ctx, ctx.message.channel, checkpoint)
+
+    @commands.command()
+    @commands.has_permissions(manage_messages=True)
+    @commands.max_concurrency(1, per=commands.BucketType.channel)
+    async def resumemove(self, ctx):
+        """Resume a move in this channel that was interrupted by a restart"""
+        await ctx.message.delete()
+        checkpoint = self.move_checkpoints(ctx.guild).get(str(ctx.message.channel.id))
+        if checkpoint is None:
+            await ctx.send('There is no unfinished move in this channel')
+            return
+        async with self.bot.scheduler.heavy(ctx.guild.id):
+            await self.run_move(ctx, ctx.message.channel, checkpoint)
+
+    async def run_move(self, ctx, source, checkpoint):
+        target = self.bot.get_channel(checkpoint["target"])
+        if target is None:
+            # Deleted since the move was interrupted, the remaining messages stay where they are
+            self.save_move_checkpoint(source, None)
+            await ctx.send('The target channel of this move no longer exists, the move was cancelled')
+            return
+        progress = await ctx.send(f'Moving messages to {target.mention}: {checkpoint["moved"]} done')
+        try:
+            # A webhook can post 10 embeds per message, plain channel sends only take one
+            webhook = await target.create_webhook(name=f'Moved from {source.name}')
+        except HTTPException:
+            # Missing permissions or the channel already has the maximum number of webhooks
+            webhook = None
+
+        # Source messages that were copied but not deleted yet when the checkpoint was saved
+        pending = [Object(id=message_id) for message_id in checkpoint["pending_delete"]]
+        # (message, embed) pairs of the next webhook message
+        batch = []
+        batch_characters = 0
+        sent_batches = 0
+
+        async def flush(final=False):
+            nonlocal batch, batch_characters, pending, sent_batches
+            if batch:
+                messages = [message for message, _ in batch]
+                embeds = [embed for _, embed in batch]
+                if webhook is not None:
+                    await webhook.send(embeds=embeds)
+                else:
+                    for embed in embeds:
+                        await target.send(embed=embed)
+                if not checkpoint["copy"]:
+                    pending += messages
+                checkpoint["after"] = messages[-1].id
+                checkpoint["remaining"] -= len(messages)
+                checkpoint["moved"] += len(messages)
+                batch = []
+                batch_characters = 0
+                sent_batches += 1
+            if pending and (final or len(pending) >= BULK_DELETE_LIMIT):
+                await delete_messages(source, pending)
+                pending = []
+            checkpoint["pending_delete"] = [message.id for message in pending]
+            self.save_move_checkpoint(source, checkpoint)
+            if sent_batches % PROGRESS_INTERVAL == 0:
+                await progress.edit(content=f'Moving messages to {target.mention}: {checkpoint["moved"]} done')
+
+        try:
+            if checkpoint["remaining"] > 0:
+                async for message in source.history(
+                        limit=checkpoint["remaining"], after=Object(id=checkpoint["after"]),
+                        before=Object(id=checkpoint["before"]), oldest_first=True):
+                    embed = message_embed(message)
+                    # A single embed always fits, message content is far below the character limit
+                    if len(batch) == EMBEDS_PER_MESSAGE or \
+                            batch_characters + len(embed) > EMBED_CHARACTERS_PER_MESSAGE:
+                        await flush()
+                    batch.append((message, embed))
+                    batch_characters += len(embed)
+            await flush(final=True)
+        finally:
+            if webhook is not None:
+                await webhook.delete()
+
+        self.save_move_checkpoint(source, None)
+        verb = 'Copied' if checkpoint["copy"] else 'Moved'
+        await progress.edit(content=f'{verb} {checkpoint["moved"]} messages to {target.mention}')
+
+    def archive_checkpoints(self, guild):
+        return self.store.guild(guild.id).setdefault("archive_checkpoints", {})
+
+    def save_archive_checkpoint(self, channel, checkpoint):
+        checkpoints = self.archive_checkpoints(channel.guild)
+        if checkpoint is None:
+            checkpoints.pop(str(channel.id), None)
+        else:
+            checkpoints[str(channel.id)] = checkpoint
+        self.store.mark_dirty(channel.guild.id)
+
+    @commands.command()
+    @commands.has_permissions(manage_messages=True)
+    @commands.max_concurrency(1, per=commands.BucketType.channel)
+    async def archive(self, ctx, target: TextChannel = None):
+        """Archive every message of this channel into compressed JSONL files, uploaded to target
+        (defaults to this channel) in parts that fit the upload limit"""
+        checkpoint = {
+            "target": (target or ctx.message.channel).id,
+            # Messages sent after the command are not part of the archive
+            "before": ctx.message.id,
+            "after": 0,
+            "parts": 0,
+            "archived": 0
+        }
+        async with self.bot.archive_scheduler.heavy(ctx.guild.id):
+            # Only saved once the archive actually starts, a full queue must not leave one behind
+            self.save_archive_checkpoint(ctx.message.channel, checkpoint)
+            await self.run_archive(ctx, ctx.message.channel, checkpoint)
+
+    @commands.command()
+    @commands.has_permissions(manage_messages=True)
+    @commands.max_concurrency(1, per=commands.BucketType.channel)
+    async def resumearchive(self, ctx):
+        """Resume an archive of this channel after the last uploaded part"""
+        checkpoint = self.archive_checkpoints(ctx.guild).get(str(ctx.message.channel.id))
+        if checkpoint is None:
+            await ctx.send('There is no unfinished archive in this channel')
+            return
+        async with self.bot.archive_scheduler.heavy(ctx.guild.id):
+            await self.run_archive(ctx, ctx.message.channel, checkpoint)
+
+    async def run_archive(self, ctx, source, checkpoint):
+        target = self.bot.get_channel(checkpoint["target"])
+        if target is None:
+            self.save_archive_checkpoint(source, None)
+            await ctx.send('The channel this archive was uploaded to no longer exists, the archive was cancelled')
+            return
+        part_size = ctx.guild.filesize_limit - ARCHIVE_SIZE_MARGIN
+        progress = await ctx.send(f'Archiving {source.mention}: {checkpoint["archived"]} messages done')
+        loop = self.bot.loop
+
+        with tempfile.TemporaryDirectory() as directory:
+            # Only one page of records and one part file exist at any time
+            part = None
+            page = []
+            pages = 0
+
+            def part_count():
+                return part.count if part is not None else 0
+
+            async def upload():
+                nonlocal part
+                await loop.run_in_executor(None, part.close)
+                number = checkpoint["parts"] + 1
+                await target.send(
+                    f'Archive of {source.mention}, part {number}: {part.count} messages',
+                    file=File(part.path, filename=os.path.basename(part.path)))
+                os.remove(part.path)
+                # Only uploaded messages count, a resume continues right after them
+                checkpoint["parts"] = number
+                checkpoint["archived"] += part.count
+                checkpoint["after"] = part.last_id
+                self.save_archive_checkpoint(source, checkpoint)
+                part = None
+
+            async def write_page():
+                nonlocal part, page, pages
+                if part is None:
+                    name = f'{source.name}-{source.id}-part{checkpoint["parts"] + 1:04d}.jsonl.gz'
+                    part = ArchivePart(os.path.join(directory, name))
+                # Compression runs off the event loop
+                await loop.run_in_executor(None, part.write, page)
+                page = []
+                pages += 1
+                if part.size >= part_size:
+                    await upload()
+                if pages % PROGRESS_INTERVAL == 0:
+                    await progress.edit(
+                        content=f'Archiving {source.mention}: {checkpoint["archived"] + part_count()} messages done')
+
+            try:
+                async for message in source.history(
+                        limit=None, after=Object(id=checkpoint["after"]),
+                        before=Object(id=checkpoint["before"]), oldest_first=True):
+                    page.append(message_record(message))
+                    if len(page) == ARCHIVE_PAGE_SIZE:
+                        await write_page()
+                if page:
+                    await write_page()
+                if part is not None:
+                    await upload()
+            finally:
+                if part is not None:
+                    part.close()
+
+        self.save_archive_checkpoint(source, None)
+        await progress.edit(
+            content=f'Archived {checkpoint["archived"]} messages of {source.mention} in {checkpoint["parts"]} parts')
 
     @move.error
     async def move_error(self, ctx, error):
@@ -1,146 +1,101 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import multiprocessing
+
 from discord.ext import commands
 from discord import File
-from pandas import DataFrame
-from datetime import datetime
-import matplotlib.pyplot as plt
-import networkx as nx
+
+from utils import workers
+from utils.chart_cache import ChartCache
+from utils.role_stats import RoleStatsIndex
 
 
 class Metrics(commands.Cog):
 
 	def __init__(self, bot):
 		self.bot = bot
+		# Rendering is CPU bound, keep it out of the event loop's process entirely. Workers start from
+		# a clean process, forking the bot with its threads, sockets and database handles can deadlock them
+		start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+		self.pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context(start_method))
+		self.cache = ChartCache()
+		# Role counts are maintained from gateway events instead of walking the member cache per chart,
+		# the initial counts of a guild are computed in the worker processes
+		self.role_stats = RoleStatsIndex(self.pool)
+
+	def cog_unload(self):
+		self.pool.shutdown(wait=False)
+
+	async def render(self, guild, job, *args):
+		"""Return the path of the rendered chart, only rendering if these exact inputs have not been seen.
+		job names a function in utils.charts, which is only ever imported by the worker processes"""
+		key = self.cache.fingerprint(job, *args)
+		return await self.cache.get_or_render(key, lambda: self._render(guild, job, *args))
+
+	async def _render(self, guild, job, *args):
+		# Cache misses take a slot from the shared scheduler, one per guild, queued fairly with other guilds
+		async with self.bot.scheduler.heavy(guild.id):
+			return await self.bot.loop.run_in_executor(self.pool, workers.run, 'utils.charts', job, *args)
+
+	@commands.Cog.listener()
+	async def on_ready(self):
+		for guild in self.bot.guilds:
+			await self.role_stats.build(guild)
+
+	@commands.Cog.listener()
+	async def on_guild_join(self, guild):
+		await self.role_stats.build(guild)
+
+	@commands.Cog.listener()
+	async def on_guild_remove(self, guild):
+		self.role_stats.drop(guild)
+
+	@commands.Cog.listener()
+	async def on_member_join(self, member):
+		self.role_stats.member_joined(member)
+
+	@commands.Cog.listener()
+	async def on_member_remove(self, member):
+		self.role_stats.member_left(member)
+
+	@commands.Cog.listener()
+	async def on_member_update(self, before, after):
+		if before.roles != after.roles:
+			self.role_stats.member_updated(before, after)
+
+	@commands.Cog.listener()
+	async def on_guild_role_create(self, role):
+		self.role_stats.role_created(role)
+
+	@commands.Cog.listener()
+	async def on_guild_role_delete(self, role):
+		self.role_stats.role_deleted(role)
 
 	@commands.command()
+	@commands.max_concurrency(1, per=commands.BucketType.user)
 	async def networkplot(self, ctx):
-		# Create dict of role names and the number of members in each
-		roles = [str(role.name) for role in ctx.guild.roles]
-		roles.remove('@everyone')
-
-		df = DataFrame(columns=roles, index=roles)
-		df[:] = int(0)
-
-		for member in ctx.guild.members:
-			member_roles = [role.name for role in member.roles]
-			if '@everyone' in member_roles:
-				member_roles.remove('@everyone')
-			for role in member_roles:
-				for co_role in member_roles:
-					df.loc[role,co_role] += 1
-					df.loc[co_role,role] += 1
-
-			max_connection_weight = df.max().max()
-
-		edge_list = []
-		for index, row in df.iterrows():
-			i = 0
-			for col in row:
-				weight = float(col) / max_connection_weight
-				edge_list.append((index, df.columns[i], weight))
-				i += 1
-
-		# Remove edge if 0.0
-		updated_edge_list = [x for x in edge_list if not x[2] == 0.0]
-
-		node_list = []
-		for r in roles:
-			for e in updated_edge_list:
-				if r == e[0] and r == e[1]:
-					node_list.append((r, e[2] * 6))
-		for i in node_list:
-			if i[1] == 0.0:
-				node_list.remove(i)
-
-		# remove self references
-		for i in updated_edge_list:
-			if i[0] == i[1]:
-				updated_edge_list.remove(i)
-
-		# Create plot
-
-		# set canvas size
-		plt.subplots(figsize=(14, 14))
-
-		# networkx graph time!
-		graph = nx.Graph()
-		for i in sorted(node_list):
-			graph.add_node(i[0], size=i[1])
-		graph.add_weighted_edges_from(updated_edge_list)
-
-		# check data of graphs
-		# G.nodes(data=True)
-		# G.edges(data = True)
-
-		# manually copy and pasted the node order using 'nx.nodes(G)'
-		# Couldn't determine another route to listing out the order of nodes for future work
-		node_order = [str(x) for x in nx.nodes(graph)]
-
-		# reorder node list
-		updated_node_order = []
-		for i in node_order:
-			for x in node_list:
-				if x[0] == i:
-					updated_node_order.append(x)
-
-		# reorder edge list
-		test = nx.get_edge_attributes(graph, 'weight')
-		updated_again_edges = []
-		for i in nx.edges(graph):
-			for x in test.keys():
-				if i[0] == x[0] and i[1] == x[1]:
-					updated_again_edges.append(test[x])
-
-		# Drawing customization
-		node_scalar = 1600
-		edge_scalar = 20
-		sizes = [x[1] * node_scalar for x in updated_node_order]
-		widths = [x * edge_scalar for x in updated_again_edges]
-
-		# Draw the graph
-		pos = nx.spring_layout(graph, k=0.42, iterations=17)
-		plt.title(f'{ctx.guild.name} role co-occurrence graph')
-		nx.draw(
-					graph, pos,
-					with_labels=True,
-					font_size=8,
-					font_weight='bold',
-					node_size=sizes,
-					width=widths
-				)
-
-		# One co-occurrence image per server
-		image_path = f'./assets/network_charts/{ctx.guild.id}.png'
-		plt.savefig(image_path, format="PNG")
-		await ctx.message.author.send(f'{ctx.guild.name} roles chart', file=File(image_path))
+		# Collect plain role data for the worker from the precomputed statistics
+		roles = [role for role in ctx.guild.roles if not role.is_default()]
+		counts, pairs = (await self.role_stats.get(ctx.guild)).co_occurrence([role.id for role in roles])
+
+		role_names = [str(role.name) for role in roles]
+		image_path = await self.render(ctx.guild, 'render_network_chart', ctx.guild.name, role_names, counts, pairs)
+		await ctx.message.author.send(
+			f'{ctx.guild.name} roles chart', file=File(image_path, filename=f'{ctx.guild.id}.png'))
 
 	@commands.command()
-	async def plot(self, ctx):
+	@commands.max_concurrency(1, per=commands.BucketType.user)
+	async def plot(self, ctx, page: int = 1):
+		"""Chart of how many members hold each role, large servers are split into pages"""
 		# Create dict of role names and the number of members in each
-		roles_dict = {role.name: [len(role.members)] for role in ctx.guild.roles}
-		roles_dict.pop('@everyone', None)
-
-		# Create plot
-		data_frame = DataFrame.from_dict(roles_dict).sort_values(by=0, axis=1, ascending=False).transpose()
-		sizing = len(data_frame.columns) * 2
-		data_frame.plot(
-			title=f"{ctx.guild.name} roles on {datetime.today().strftime('%Y-%m-%d')}\n"
-					f"Average: {data_frame.describe().iloc[1].head(1)[0]} "
-					f" Std. Dev: {round(data_frame.describe().iloc[2].head(1)[0],4)}\n"
-					f"Higher Quartile: {data_frame.describe().iloc[6].head(1)[0]} "
-					f" Lower Quartile: {data_frame.describe().iloc[4].head(1)[0]}",
-			kind='bar',
-			width=.2, rot=90,
-			fontsize=12,
-			legend=False,
-			figsize=(20 + sizing * 2, 10 + sizing)
-		)
-
-		# One roles images per server
-		image_path = f'./assets/role_charts/{ctx.guild.id}.png'
-		plt.draw()
-		plt.tight_layout()
-		plt.savefig(image_path)
-		await ctx.message.author.send(f'{ctx.guild.name} roles chart', file=File(image_path))
+		stats = await self.role_stats.get(ctx.guild)
+		role_counts = {role.name: stats.counts.get(role.id, 0) for role in ctx.guild.roles if not role.is_default()}
+
+		image_path = await self.render(
+			ctx.guild, 'render_role_chart', ctx.guild.name, role_counts,
+			datetime.today().strftime('%Y-%m-%d'), page)
+		await ctx.message.author.send(
+			f'{ctx.guild.name} roles chart', file=File(image_path, filename=f'{ctx.guild.id}.png'))
 
 
 def setup(bot):
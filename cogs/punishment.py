@@ -1,48 +1,87 @@
-from datetime import datetime
-import json
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import re
 
-from discord import Embed, Guild, User
-from discord.utils import get
+from discord import Embed, Guild, HTTPException, Object, User
 from discord.ext import commands
 
+from utils.report_store import ReportStore
+
+
+# Upper bound of users a single mass action may target, and how many of its API calls run at once
+MASS_ACTION_LIMIT = 1000
+MASS_ACTION_CONCURRENCY = 5
+REPORTS_PER_PAGE = 10
+USER_CACHE_SIZE = 512
+
+
+def user_name(user):
+	return f'{user.name}#{user.discriminator}'
+
+
+def report_record(action: str, body: str, issuer: User, subject, subject_name: str = None):
+	return {
+		"action": action,
+		"issuer_id": issuer.id,
+		"issuer": user_name(issuer),
+		"subject_id": subject.id,
+		"subject": subject_name or user_name(subject),
+		"body": body
+	}
+
 
 class IncidentReport:
 
-	def __init__(self, server: Guild, action: str, body: str, issuer: User, subject: User):
+	def __init__(self, server: Guild, action: str, body: str, issuer: User, subject: User, store: ReportStore):
 		self.action = action
 		self.issuer = issuer
 		self.subject = subject
 		self.body = body
 		self.server = server
-		self.config_full = json.loads(open('config.json').read())
-		self.config = self.config_full[str(self.server.id)]
-		self.report_number = self.next_report_number()
-		self.finalize_report()
-
-	def next_report_number(self):
-		return len(self.config['reports']) + 1
-
-	def finalize_report(self):
-		report = {
-			"report_id": self.report_number,
-			"action": self.action,
-			"issuer": f'{self.issuer.name}#{self.issuer.discriminator}',
-			"subject": f'{self.subject.name}#{self.subject.discriminator}',
-			"body": self.body
-		}
-		self.config["reports"].update({self.report_number: report})
-		json.dump(self.config_full, open('config.json', 'w'), indent=2, separators=(',', ': '))
+		self.store = store
+		self.report_number = None
+
+	async def finalize_report(self):
+		"""Store the report, the store hands out the case number"""
+		report = report_record(self.action, self.body, self.issuer, self.subject)
+		# Append-only insert, other guilds' reports are never touched
+		self.report_number = await self.store.add(self.server.id, report)
+		return self.report_number
 
 	def generate_receipt(self):
 		embed = Embed(title='Incident Report', description=f'Case Number: {self.report_number}', color=0xff0000)
-		embed.add_field(name="Issued By:", value=f'{self.issuer.name}#{self.issuer.discriminator}')
-		embed.add_field(name="Subject:", value=f'{self.subject.name}#{self.subject.discriminator}')
+		embed.add_field(name="Issued By:", value=user_name(self.issuer))
+		embed.add_field(name="Subject:", value=user_name(self.subject))
 		embed.add_field(name='Action', value=self.action)
 		embed.add_field(name='Reason', value=self.body)
 		embed.timestamp = datetime.utcnow()
 		return embed
 
 
+def report_embed(report):
+	embed = Embed(title='Incident Report', description=f'Case Number: {report["report_id"]}', color=0xff0000)
+	embed.add_field(name="Issued By:", value=report["issuer"])
+	embed.add_field(name="Subject:", value=report["subject"])
+	embed.add_field(name='Action', value=report["action"])
+	embed.add_field(name='Reason', value=report["body"])
+	return embed
+
+
+def report_page_embed(reports, page, pages, total):
+	embed = Embed(title='Incident Reports', description=f'{total} reports found', color=0xff0000)
+	for report in reports:
+		# Keep ten reports well within the embed size limit
+		reason = report["body"] if len(report["body"]) <= 300 else f'{report["body"][:297]}...'
+		embed.add_field(
+			name=f'Case Number: {report["report_id"]} ({report["action"]})',
+			value=f'Issued By: {report["issuer"]}\nSubject: {report["subject"]}\nReason: {reason}',
+			inline=False
+		)
+	embed.set_footer(text=f'Page {page}/{pages}' + (', use --page <number> to see more' if pages > 1 else ''))
+	return embed
+
+
 async def handle_error(ctx, error):
 	if isinstance(error, commands.MissingRequiredArgument):
 		await ctx.send(
@@ -57,32 +96,67 @@ class Punishment(commands.Cog):
 
 	def __init__(self, bot):
 		self.bot = bot
-		self.config_full = json.loads(open('config.json').read())
+		self.store = bot.config_store
+		self.reports = bot.report_store
+		self.user_cache = OrderedDict()
+
+	async def moderate(self, ctx, target: User, action: str, reason: str, past_tense: str = None, apply=None,
+						notify_target: bool = True):
+		"""Shared pipeline of every moderation command: file the report, apply the action and send
+		all the receipts concurrently. A failed receipt (e.g. closed DMs) never stops the others.
+		apply is a coroutine function performing the action, if there is one. If the action fails
+		the report is withdrawn again and None is returned"""
+		guild = ctx.message.guild
+		report = IncidentReport(guild, action, reason, ctx.message.author, target, self.reports)
+		await report.finalize_report()
+		receipt = report.generate_receipt()
+		target_name = user_name(target)
+		if past_tense is not None:
+			issuer_text = f'User: {target_name} has been {past_tense}. The incident report is attached below:'
+			target_text = f'You have been {past_tense} from {guild}. The incident report is attached below:'
+		else:
+			issuer_text = target_text = 'Incident report receipt:'
+
+		if notify_target and apply is not None:
+			# The subject can no longer be reached once they share no server with the bot, so their DM goes first
+			try:
+				await target.send(target_text, embed=receipt)
+			except HTTPException:
+				pass
+		if apply is not None:
+			try:
+				await apply()
+			except HTTPException as error:
+				# Missing permissions, role hierarchy, unknown user: withdraw the case for the action that never happened
+				await self.reports.delete(guild.id, report.report_number)
+				notices = [ctx.send(
+					f'Could not {action.lower()} {target_name}: {error.text or error}. '
+					f'Report {report.report_number} was withdrawn')]
+				if notify_target:
+					notices.append(target.send(f'Please disregard the previous message, you have not been {past_tense}'))
+				await asyncio.gather(*notices, return_exceptions=True)
+				return None
+
+		notifications = [ctx.message.author.send(issuer_text, embed=receipt)]
+		if notify_target and apply is None:
+			notifications.append(target.send(target_text, embed=receipt))
+		if past_tense is not None:
+			notifications.append(ctx.send(f'User: {target_name} has been {past_tense}. Report ID: {report.report_number}'))
+		report_channel_id = self.store.guild(guild.id)["reporting_channel"]
+		if report_channel_id is not None:
+			report_channel = guild.get_channel(report_channel_id)
+			if report_channel is not None:
+				notifications.append(report_channel.send(embed=receipt))
+		await asyncio.gather(*notifications, return_exceptions=True)
+		return report
 
 	@commands.command()
 	@commands.has_permissions(kick_members=True)
 	async def kick(self, ctx, target: User, *, reason: str):
 		"""Kick the specified user (a report receipt will be send to the recipient and issuer,
 		and optionally reporting channel if enabled)"""
-		report = IncidentReport(ctx.message.guild, 'Kick', reason, ctx.message.author, target)
-		receipt = report.generate_receipt()
-		await ctx.message.author.send(
-			f'User: {target.name}#{target.discriminator} has been kicked. The incident report is attached below:',
-			embed=receipt)
-		await target.send(
-							f'You have been kicked from {ctx.message.guild}. The incident report is attached below:',
-							embed=receipt
-						)
-		await ctx.message.guild.kick(target, reason=reason)
-		await ctx.send(f'User: {target.name}#{target.discriminator} has been kicked. Report ID: {report.report_number}')
-		reporting_enabled = True if self.config_full[str(ctx.message.guild.id)][
-										"reporting_channel"] is not None else False
-		if reporting_enabled:
-			report_channel = get(
-									ctx.message.guild.text_channels,
-									id=self.config_full[str(ctx.message.guild.id)]["reporting_channel"]
-								)
-			await report_channel.send(embed=receipt)
+		await self.moderate(
+			ctx, target, 'Kick', reason, 'kicked', lambda: ctx.message.guild.kick(target, reason=reason))
 
 	@kick.error
 	async def kick_error(self, ctx, error):
@@ -93,25 +167,8 @@ class Punishment(commands.Cog):
 	async def ban(self, ctx, target: User, *, reason: str):
 		"""Ban the specified user (a report receipt will be sent to the recipient and issuer,
 		and optionally reporting channel if enabled)"""
-		report = IncidentReport(ctx.message.guild, 'Ban', reason, ctx.message.author, target)
-		receipt = report.generate_receipt()
-		await ctx.message.author.send(
-			f'User: {target.name}#{target.discriminator} has been banned. The incident report is attached below:',
-			embed=receipt)
-		await target.send(
-							f'You have been banned from {ctx.message.guild}. The incident report is attached below:',
-							embed=receipt
-						)
-		await ctx.message.guild.ban(target, reason=reason)
-		await ctx.send(f'User: {target.name}#{target.discriminator} has been banned. Report ID: {report.report_number}')
-		reporting_enabled = True if self.config_full[str(ctx.message.guild.id)][
-										"reporting_channel"] is not None else False
-		if reporting_enabled:
-			report_channel = get(
-									ctx.message.guild.text_channels,
-									id=self.config_full[str(ctx.message.guild.id)]["reporting_channel"]
-								)
-			await report_channel.send(embed=receipt)
+		await self.moderate(
+			ctx, target, 'Ban', reason, 'banned', lambda: ctx.message.guild.ban(target, reason=reason))
 
 	@ban.error
 	async def ban_error(self, ctx, error):
@@ -122,21 +179,9 @@ class Punishment(commands.Cog):
 	async def hackban(self, ctx, target: int, *, reason: str):
 		"""Ban a user not in the server"""
 		user = await self.bot.fetch_user(target)
-		report = IncidentReport(ctx.message.guild, 'Hackban', reason, ctx.message.author, user)
-		receipt = report.generate_receipt()
-		await ctx.message.author.send(
-			f'User: {user.name}#{user.discriminator} has been hackbanned. The incident report is attached below:',
-			embed=receipt)
-		await ctx.message.guild.ban(user, reason=reason)
-		await ctx.send(f'User: {user.name}#{user.discriminator} has been hackbanned. Report ID: {report.report_number}')
-		reporting_enabled = True if self.config_full[str(ctx.message.guild.id)][
-										"reporting_channel"] is not None else False
-		if reporting_enabled:
-			report_channel = get(
-									ctx.message.guild.text_channels,
-									id=self.config_full[str(ctx.message.guild.id)]["reporting_channel"]
-								)
-			await report_channel.send(embed=receipt)
+		await self.moderate(
+			ctx, user, 'Hackban', reason, 'hackbanned', lambda: ctx.message.guild.ban(user, reason=reason),
+			notify_target=False)
 
 	@hackban.error
 	async def hackban_error(self, ctx, error):
@@ -148,22 +193,9 @@ class Punishment(commands.Cog):
 		"""Unban the specified user (a report receipt will be sent to the recipient and
 		issuer, and optionally reporting channel if enabled, user ID number required)"""
 		target = await self.bot.fetch_user(target_id)
-		report = IncidentReport(ctx.message.guild, 'Unban', reason, ctx.message.author, target)
-		receipt = report.generate_receipt()
-		await ctx.message.author.send(
-			f'User: {target.name}#{target.discriminator} has been unbanned. The incident report is attached below:',
-			embed=receipt)
-		await ctx.message.guild.unban(target)
-		await ctx.send(
-			f'User: {target.name}#{target.discriminator} has been unbanned. Report ID: {report.report_number}')
-		reporting_enabled = True if self.config_full[str(ctx.message.guild.id)][
-										"reporting_channel"] is not None else False
-		if reporting_enabled:
-			report_channel = get(
-									ctx.message.guild.text_channels,
-									id=self.config_full[str(ctx.message.guild.id)]["reporting_channel"]
-								)
-			await report_channel.send(embed=receipt)
+		await self.moderate(
+			ctx, target, 'Unban', reason, 'unbanned', lambda: ctx.message.guild.unban(target),
+			notify_target=False)
 
 	@unban.error
 	async def unban_error(self, ctx, error):
@@ -174,108 +206,169 @@ class Punishment(commands.Cog):
 	async def report(self, ctx, target: User, action: str, *, reason: str):
 		"""Create a custom incident report, action must be one word
 		(receipt will be sent to recipient and issuer, and optionally reporting channel if enabled) """
-		report = IncidentReport(ctx.message.guild, action, reason, ctx.message.author, target)
-		receipt = report.generate_receipt()
-		await ctx.message.author.send(f'Incident report receipt:', embed=receipt)
-		await target.send(f'Incident report receipt:', embed=receipt)
-		reporting_enabled = True if self.config_full[str(ctx.message.guild.id)][
-										"reporting_channel"] is not None else False
-		if reporting_enabled:
-			report_channel = get(
-									ctx.message.guild.text_channels,
-									id=self.config_full[str(ctx.message.guild.id)]["reporting_channel"]
-								)
-			await report_channel.send(embed=receipt)
+		await self.moderate(ctx, target, action, reason)
 
 	@report.error
 	async def report_error(self, ctx, error):
 		await handle_error(ctx, error)
 
+	def mass_targets(self, ctx, targets, reason):
+		"""Resolve user ids, or a '--joined <minutes>' selector at the start of the reason,
+		to (targets, reason)"""
+		match = re.match(r'--joined\s+(\d+)\s+(.+)', reason, re.S)
+		if not targets and match:
+			since = datetime.utcnow() - timedelta(minutes=int(match.group(1)))
+			targets = [
+				member for member in ctx.message.guild.members
+				if member.joined_at is not None and member.joined_at > since and member != ctx.message.author
+				and member != ctx.me
+			]
+			reason = match.group(2)
+		else:
+			targets = [ctx.message.guild.get_member(target) or Object(id=target) for target in dict.fromkeys(targets)]
+		return targets, reason
+
+	async def mass_action(self, ctx, action: str, past_tense: str, apply, targets, reason: str):
+		"""Apply an action to many users with bounded concurrency, file every report in one
+		transaction and send one aggregated receipt"""
+		guild = ctx.message.guild
+		if not targets:
+			await ctx.send('No users matched')
+			return
+		if len(targets) > MASS_ACTION_LIMIT:
+			await ctx.send(f'At most {MASS_ACTION_LIMIT} users can be targeted at once')
+			return
+		progress = await ctx.send(f'{action} of {len(targets)} users in progress...')
+		semaphore = asyncio.Semaphore(MASS_ACTION_CONCURRENCY)
+
+		async def run(target):
+			async with semaphore:
+				await apply(target)
+
+		results = await asyncio.gather(*[run(target) for target in targets], return_exceptions=True)
+		succeeded = [target for target, result in zip(targets, results) if not isinstance(result, Exception)]
+		failed = [target for target, result in zip(targets, results) if isinstance(result, Exception)]
+
+		records = []
+		for target in succeeded:
+			# Users that are not cached are only known by id
+			name = user_name(target) if hasattr(target, 'discriminator') else str(target.id)
+			records.append(report_record(action, reason, ctx.message.author, target, name))
+		report_ids = await self.reports.add_many(guild.id, records)
+
+		receipt = Embed(title=f'Mass {action}', description=f'{len(succeeded)} users {past_tense}', color=0xff0000)
+		receipt.add_field(name="Issued By:", value=user_name(ctx.message.author))
+		if report_ids:
+			receipt.add_field(name='Case Numbers', value=f'{report_ids[0]} - {report_ids[-1]}')
+		if failed:
+			failed_ids = ', '.join(str(target.id) for target in failed[:20])
+			receipt.add_field(name=f'Failed ({len(failed)})', value=failed_ids + (' ...' if len(failed) > 20 else ''))
+		receipt.add_field(name='Reason', value=reason)
+		receipt.timestamp = datetime.utcnow()
+
+		notifications = [progress.edit(content=None, embed=receipt)]
+		report_channel_id = self.store.guild(guild.id)["reporting_channel"]
+		report_channel = guild.get_channel(report_channel_id) if report_channel_id is not None else None
+		if report_channel is not None:
+			notifications.append(report_channel.send(embed=receipt))
+		await asyncio.gather(*notifications, return_exceptions=True)
+
+	@commands.command()
+	@commands.has_permissions(ban_members=True)
+	@commands.max_concurrency(1, per=commands.BucketType.guild)
+	async def massban(self, ctx, targets: commands.Greedy[int], *, reason: str):
+		"""Ban many users at once by ID, or everyone who joined in the last N minutes with
+		b!massban --joined <minutes> <reason> (one aggregated receipt is sent)"""
+		targets, reason = self.mass_targets(ctx, targets, reason)
+		await self.mass_action(
+			ctx, 'Ban', 'banned', lambda target: ctx.message.guild.ban(target, reason=reason), targets, reason)
+
+	@massban.error
+	async def massban_error(self, ctx, error):
+		await handle_error(ctx, error)
+
+	@commands.command()
+	@commands.has_permissions(kick_members=True)
+	@commands.max_concurrency(1, per=commands.BucketType.guild)
+	async def masskick(self, ctx, targets: commands.Greedy[int], *, reason: str):
+		"""Kick many users at once by ID, or everyone who joined in the last N minutes with
+		b!masskick --joined <minutes> <reason> (one aggregated receipt is sent)"""
+		targets, reason = self.mass_targets(ctx, targets, reason)
+		await self.mass_action(
+			ctx, 'Kick', 'kicked', lambda target: ctx.message.guild.kick(target, reason=reason), targets, reason)
+
+	@masskick.error
+	async def masskick_error(self, ctx, error):
+		await handle_error(ctx, error)
+
+	async def resolve_user(self, user_id):
+		"""User object for an id, from the client cache or a small LRU of fetched users"""
+		user = self.bot.get_user(user_id) or self.user_cache.get(user_id)
+		if user is None:
+			user = await self.bot.fetch_user(user_id)
+		self.user_cache[user_id] = user
+		self.user_cache.move_to_end(user_id)
+		if len(self.user_cache) > USER_CACHE_SIZE:
+			self.user_cache.popitem(last=False)
+		return user
+
 	@commands.command()
 	async def lookup(self, ctx, *, args: str):
 		"""Search for a report by user ID, mention, or report ID number, use b!lookup <report id> --receipt
-		to have a copy sent to you via DM"""
-		config = self.config_full[str(ctx.message.guild.id)]
-		reports = config["reports"]
-		length_args = len(args.strip())
-		embed = None
-		if length_args == 18:
-			# User ID has been provided
-			user = await self.bot.fetch_user(args)
-			user_name = f'{user.name}#{user.discriminator}'
-			results = []
-			reports = config["reports"]
-			for report_iter in config["reports"]:
-				report_num = str(report_iter)
-				if reports[report_num]["issuer"] == user_name or reports[report_num]["subject"] == user_name:
-					results.append(report_num)
-			if results:
-				for result in results:
-					embed = Embed(
-									title='Incident Report', description=f'Case Number: {reports[result]["report_id"]}',
-									color=0xff0000
-								)
-					embed.add_field(name="Issued By:", value=reports[result]["issuer"])
-					embed.add_field(name="Subject:", value=reports[result]["subject"])
-					embed.add_field(name='Action', value=reports[result]["action"])
-					embed.add_field(name='Reason', value=reports[result]["body"])
-					await ctx.send(embed=embed)
-			else:
-				await ctx.send('No reports found with the user provided')
-		elif ctx.message.mentions:
-			# User provided via mention
-			user = ctx.message.mentions[0]
-			user_name = f'{user.name}#{user.discriminator}'
-			results = []
-			reports = config["reports"]
-			for report_iter in config["reports"]:
-				report_num = str(report_iter)
-				if reports[report_num]["subject"] == user_name:
-					results.append(report_num)
-			if results:
-				for result in results:
-					embed = Embed(
-									title='Incident Report', description=f'Case Number: {reports[result]["report_id"]}',
-									color=0xff0000
-								)
-					embed.add_field(name="Issued By:", value=reports[result]["issuer"])
-					embed.add_field(name="Subject:", value=reports[result]["subject"])
-					embed.add_field(name='Action', value=reports[result]["action"])
-					embed.add_field(name='Reason', value=reports[result]["body"])
-					await ctx.send(embed=embed)
-			else:
-				await ctx.send('No reports found with the user provided')
+		to have a copy sent to you via DM. User searches show 10 reports per page, use --page <number>"""
+		guild_id = ctx.message.guild.id
+		receipt = '--receipt' in args
+		page_match = re.search(r'--page\s+(\d+)', args)
+		page = max(int(page_match.group(1)), 1) if page_match else 1
+		query = re.sub(r'--page\s+\d+|--receipt', '', args).strip()
+
+		if ctx.message.mentions:
+			# User provided via mention, only reports about them
+			user_id = ctx.message.mentions[0].id
+			subject_only = True
+		elif query.isdigit() and len(query) >= 17:
+			# User ID has been provided, reports about them and issued by them
+			user_id = int(query)
+			subject_only = False
 		else:
-			# Looking up by ID as no users were mentioned
-			report = reports.get(args, None)
-			if report is not None:
-				embed = Embed(
-								title='Incident Report', description=f'Case Number: {report["report_id"]}',
-								color=0xff0000
-							)
-				embed.add_field(name="Issued By:", value=report["issuer"])
-				embed.add_field(name="Subject:", value=report["subject"])
-				embed.add_field(name='Action', value=report["action"])
-				embed.add_field(name='Reason', value=report["body"])
-				await ctx.send(embed=embed)
-			else:
+			# Looking up by ID as no users were given
+			report = self.reports.get(guild_id, int(query)) if query.isdigit() else None
+			if report is None:
 				await ctx.send('No reports found with the ID number provided')
-		if not ctx.message.mentions and args.endswith("--receipt"):
-			# If user requests a copy of the report, DM it to them (only single reports can be sent via DM)
-			await ctx.message.author.send(embed=embed)
+				return
+			embed = report_embed(report)
+			await ctx.send(embed=embed)
+			if receipt:
+				# If user requests a copy of the report, DM it to them (only single reports can be sent via DM)
+				await ctx.message.author.send(embed=embed)
+			return
+
+		# Reports are matched by user id, only migrated reports without ids need the user's name
+		name = None
+		if self.reports.has_legacy_reports(guild_id):
+			try:
+				name = user_name(await self.resolve_user(user_id))
+			except HTTPException:
+				# Deleted account or mistyped id, reports with user ids can still be found
+				pass
+		total = self.reports.count_by_user(guild_id, user_id, name, subject_only)
+		if not total:
+			await ctx.send('No reports found with the user provided')
+			return
+		pages = -(-total // REPORTS_PER_PAGE)
+		page = min(page, pages)
+		results = self.reports.by_user(
+			guild_id, user_id, name, subject_only, limit=REPORTS_PER_PAGE, offset=(page - 1) * REPORTS_PER_PAGE)
+		await ctx.send(embed=report_page_embed(results, page, pages, total))
 
 	@commands.command()
 	@commands.has_permissions(manage_guild=True)
 	async def recall(self, ctx, report_id: str):
 		"""Clear a single report, you must have the ID number. If you need the report number,
 		use b!lookup <user mention or ID> to find the number"""
-		try:
-			config = self.config_full[str(ctx.message.guild.id)]
-			reports = config["reports"]
-			reports.pop(report_id)
-			json.dump(self.config_full, open('config.json', 'w'), indent=2, separators=(',', ': '))
+		if report_id.isdigit() and await self.reports.delete(ctx.message.guild.id, int(report_id)):
 			await ctx.send(f'Report #{report_id} successfully cleared!')
-		except KeyError:
+		else:
 			await ctx.send('No report with that ID was found, double check the ID you entered')
 
 
@@ -0,0 +1,80 @@
+from discord import Embed
+from discord.ext import commands, tasks
+
+from utils.files import write_atomic
+
+# Prometheus text format dump, for a node exporter textfile collector or a quick look with cat
+METRICS_PATH = 'metrics.prom'
+
+
+def latency_line(name, histogram):
+	return f'`{name}` {histogram.count}x, p50 {histogram.percentile(0.5) * 1000:.0f}ms, ' \
+		f'p95 {histogram.percentile(0.95) * 1000:.0f}ms, max {histogram.max * 1000:.0f}ms'
+
+
+def slowest(series, count=8):
+	return sorted(series.items(), key=lambda item: item[1].percentile(0.95), reverse=True)[:count]
+
+
+class Stats(commands.Cog):
+
+	def __init__(self, bot):
+		self.bot = bot
+		self.registry = bot.stats
+		self.lag_sampler = bot.loop.create_task(self.registry.sample_loop_lag())
+		self.dump_metrics.start()
+
+	def cog_unload(self):
+		self.lag_sampler.cancel()
+		self.dump_metrics.cancel()
+
+	def update_gauges(self):
+		gauges = self.registry.gauges
+		gauges['bot_guilds'] = len(self.bot.guilds)
+		gauges['bot_gateway_latency_seconds'] = f'{self.bot.latency:.6f}'
+		gauges['bot_heavy_jobs_running'] = self.bot.scheduler.running
+		gauges['bot_heavy_jobs_queued'] = self.bot.scheduler.queued
+		gauges['bot_archives_running'] = self.bot.archive_scheduler.running
+		gauges['bot_archives_queued'] = self.bot.archive_scheduler.queued
+		verification = self.bot.get_cog('Verification')
+		if verification is not None:
+			gauges['bot_verifications_in_flight'] = verification.sessions.in_flight
+			gauges['bot_verifications_completed'] = verification.sessions.completed
+			gauges['bot_verifications_timed_out'] = verification.sessions.timeouts
+
+	@tasks.loop(seconds=30)
+	async def dump_metrics(self):
+		self.update_gauges()
+		await self.bot.loop.run_in_executor(None, write_atomic, METRICS_PATH, self.registry.prometheus())
+
+	@commands.command()
+	@commands.is_owner()
+	async def stats(self, ctx):
+		"""Command and event latencies, event loop lag and REST usage since startup"""
+		self.update_gauges()
+		stats = self.registry
+		embed = Embed(title='Bot statistics', color=0x9370DB)
+		embed.add_field(
+			name='Commands (slowest p95)',
+			value='\n'.join(latency_line(name, histogram) for name, histogram in slowest(stats.commands)) or 'None yet',
+			inline=False)
+		embed.add_field(
+			name='Events (slowest p95)',
+			value='\n'.join(latency_line(name, histogram) for name, histogram in slowest(stats.events)) or 'None yet',
+			inline=False)
+		embed.add_field(name='Event loop lag', value=latency_line('lag', stats.loop_lag), inline=False)
+		embed.add_field(name='Config writes', value=latency_line('config.json', stats.config_io), inline=False)
+		routes = stats.rest_calls.most_common(8)
+		embed.add_field(
+			name=f'REST calls ({sum(stats.rest_calls.values())} total)',
+			value='\n'.join(f'`{route}` {count}' for route, count in routes) or 'None yet',
+			inline=False)
+		embed.add_field(
+			name='Gauges',
+			value='\n'.join(f'`{name}` {value}' for name, value in sorted(stats.gauges.items())),
+			inline=False)
+		await ctx.send(embed=embed)
+
+
+def setup(bot):
+	bot.add_cog(Stats(bot))
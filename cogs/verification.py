@@ -1,98 +1,89 @@
+import asyncio
+
 import aiohttp
-import json
-from random import choice, choices, randint, sample
 
 from discord import File
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.utils import get
 
+from utils.challenges import ChallengePool, WORD_LIST_URL, load_word_list, save_word_list
+from utils.verification_sessions import VerificationSessions
+
 
 class Verification(commands.Cog):
-	# Closer the number approaches 1, the more often the word list will be refreshed. Linear
 
 	def __init__(self, bot):
 		self.bot = bot
-		self.config_full = json.loads(open('config.json').read())
-		self.word_list_refresh_rate = 99
-		self.word_cache_size = 1000
+		self.store = bot.config_store
+		self.challenge_pool = ChallengePool(size=100, word_cache_size=1000)
+		# Start from the local copy of the word list, the refresh task updates it in the background
+		self.challenge_pool.set_words(load_word_list())
+		self.challenge_pool.top_up()
+		self.sessions = VerificationSessions()
+		self.refresh_word_list.start()
+		self.top_up_challenges.start()
 
-	@commands.command()
-	@commands.has_permissions(manage_guild=True)
-	async def verification(self, ctx, state: bool):
-		"""Enable or disable the verification system"""
-		config = self.config_full[str(ctx.message.guild.id)]
-		if state is True and config["verification_channel"] is None:
-			channel = await ctx.message.guild.create_text_channel(name="Verification")
-			role = await ctx.message.guild.create_role(name="Unverified")
-			config.update(verification_channel=channel.id, verification_role=role.id)
-			json.dump(self.config_full, open('config.json', 'w'), indent=2, separators=(',', ': '))
-		elif state is False and config["verification_channel"] is not None:
-			channel = get(ctx.message.guild.text_channels, id=config["verification_channel"])
-			role = get(ctx.message.guild.roles, id=config["verification_role"])
-			await channel.delete()
-			await role.delete()
-			config.update(verification_channel=None, verification_role=None)
-			json.dump(self.config_full, open('config.json', 'w'), indent=2, separators=(',', ': '))
+	def cog_unload(self):
+		self.refresh_word_list.cancel()
+		self.top_up_challenges.cancel()
 
-	@commands.command()
-	async def verify(self, ctx):
-		"""Verify yourself (the bot will DM you)"""
+	@tasks.loop(hours=24)
+	async def refresh_word_list(self):
 		try:
-			# Increment if use count exists
-			self.verify.use_count += 1
-		except AttributeError:
-			# Otherwise initialize it on verify function object for persistence
-			self.verify.use_count = 1
-
-		if self.verify.use_count % self.word_list_refresh_rate == 1:
 			# Retrieve list of words from MIT page
 			async with aiohttp.ClientSession() as client:
-				async with client.get("https://www.mit.edu/~ecprice/wordlist.10000") as response:
+				async with client.get(WORD_LIST_URL) as response:
+					response.raise_for_status()
 					text = await response.text()
-					self.verify.words = sample(text.splitlines(), self.word_cache_size)
-				await client.close()
-
-		challenge_selection = randint(0, 2)
-		challenge_wording = ['computation', 'phrase', 'single word basic color displayed on the pillow']
+		except (aiohttp.ClientError, asyncio.TimeoutError):
+			# Keep using the cached list, try again on the next refresh
+			return
+		await self.bot.loop.run_in_executor(None, save_word_list, text)
+		self.challenge_pool.set_words(text.splitlines())
 
-		# Some initialization
-		random_phrase = '( Pillows are so comfy 😊)'
-		image_selection = ['', None]
-		answer_value = 0
+	@tasks.loop(seconds=5)
+	async def top_up_challenges(self):
+		self.challenge_pool.top_up()
 
-		# Image color challenge
-		if challenge_selection == 2:
-			image_answer_pairing = [
-										['blue', './assets/blue.jpg'],
-										['red', './assets/red.jpg'],
-										['white', './assets/white.jpg'],
-										['black', './assets/black.jpg']
-									]
-			image_selection = image_answer_pairing[randint(0, 3)]
-		# Math challenge
-		elif challenge_selection == 1:
-			random_phrase = f'{randint(1,9)}{choice(["+","-","*"])}{randint(1,9)}{choice(["+","-","*"])}{randint(1,9)}'
-			answer_value = str(eval(random_phrase))
-		# Phrase challenge
-		else:
-			# Pick three random words and DM them to the user
-			random_phrase = ' '.join(choices(self.verify.words, k=3))
+	@commands.Cog.listener()
+	async def on_message(self, message):
+		# Verification answers only ever arrive as DMs
+		if message.guild is None and not message.author.bot:
+			self.sessions.dispatch(message)
 
-		insertion_point = randint(1, len(random_phrase) - 2)
-		random_phrase_modded = f'{random_phrase[:insertion_point+1]}' \
-								f'​{random_phrase[insertion_point+1:]}' \
-								f''.replace('o', 'ο').replace('e', 'е').replace('a', 'а').replace('i', 'і')
+	@commands.command()
+	@commands.has_permissions(manage_guild=True)
+	async def verification(self, ctx, state: bool):
+		"""Enable or disable the verification system"""
+		# Held across the check and the update so two toggles can not both create a channel and role
+		async with self.bot.scheduler.guild_lock(ctx.message.guild.id):
+			config = self.store.guild(ctx.message.guild.id)
+			if state is True and config["verification_channel"] is None:
+				channel = await ctx.message.guild.create_text_channel(name="Verification")
+				role = await ctx.message.guild.create_role(name="Unverified")
+				self.store.update(ctx.message.guild.id, verification_channel=channel.id, verification_role=role.id)
+				self.bot.unverified_gate.reset(ctx.message.guild)
+			elif state is False and config["verification_channel"] is not None:
+				channel = get(ctx.message.guild.text_channels, id=config["verification_channel"])
+				role = get(ctx.message.guild.roles, id=config["verification_role"])
+				await channel.delete()
+				await role.delete()
+				self.store.update(ctx.message.guild.id, verification_channel=None, verification_role=None)
+				self.bot.unverified_gate.reset(ctx.message.guild)
 
-		expected_answer = [random_phrase, answer_value, image_selection[0]][challenge_selection]
-		await ctx.message.author.send(
-			f"Please reply with the following {challenge_wording[challenge_selection]}: {random_phrase_modded}",
-			file=File(image_selection[1]) if challenge_selection == 2 else None)
-		# Wait for 30 seconds for the user to send back the verification phrase
-		await self.bot.wait_for("message", timeout=30, check=lambda message: message.content == expected_answer)
+	@commands.command()
+	async def verify(self, ctx):
+		"""Verify yourself (the bot will DM you)"""
+		challenge = self.challenge_pool.take()
+		expected_answer = challenge.answer
+		prompt = await ctx.message.author.send(
+			challenge.prompt, file=File(challenge.image) if challenge.image is not None else None)
+		# Wait for 30 seconds for the user to send back the verification phrase in the DM channel
+		await self.sessions.wait(ctx.message.author.id, prompt.channel.id, expected_answer, timeout=30)
 		await ctx.message.author.send("Verification complete 👍")
 		# If they pass, remove the unverified role
-		config = json.loads(open('config.json', 'r').read())
-		role = get(ctx.guild.roles, id=config[str(ctx.guild.id)]["verification_role"])
+		config = self.store.guild(ctx.guild.id)
+		role = get(ctx.guild.roles, id=config["verification_role"])
 		await ctx.message.author.remove_roles(role)
 
 	@verify.error
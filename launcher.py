@@ -0,0 +1,50 @@
+"""Run the bot as several processes, each connecting its own range of shards.
+
+	python launcher.py <processes> <shards>
+
+Every process runs main.py with BOT_SHARD_IDS/BOT_SHARD_COUNT set. They share
+config.json (changes are merged under a file lock) and reports.db (SQLite WAL
+with serialized write transactions). Run main.py once first to create config.json."""
+import os
+import subprocess
+import sys
+
+
+def shard_ranges(processes, shards):
+	"""Split shards 0..shards-1 into contiguous, evenly sized ranges, one per process"""
+	size, extra = divmod(shards, processes)
+	ranges = []
+	start = 0
+	for process in range(processes):
+		end = start + size + (1 if process < extra else 0)
+		ranges.append(list(range(start, end)))
+		start = end
+	return [shard_range for shard_range in ranges if shard_range]
+
+
+def main():
+	if len(sys.argv) != 3:
+		print(__doc__)
+		sys.exit(1)
+	processes, shards = int(sys.argv[1]), int(sys.argv[2])
+	if not os.path.exists('config.json'):
+		print('config.json not found, run main.py once to configure the bot')
+		sys.exit(1)
+
+	children = []
+	for shard_range in shard_ranges(processes, shards):
+		env = dict(os.environ, BOT_SHARD_COUNT=str(shards), BOT_SHARD_IDS=','.join(map(str, shard_range)))
+		print(f'Starting shards {shard_range[0]}-{shard_range[-1]} of {shards}')
+		children.append(subprocess.Popen([sys.executable, 'main.py'], env=env))
+
+	try:
+		for child in children:
+			child.wait()
+	except KeyboardInterrupt:
+		# The children got the same Ctrl+C, let them flush pending config changes and exit
+		for child in children:
+			child.wait()
+
+
+if __name__ == '__main__':
+	main()
@@ -1,113 +1,215 @@
+import asyncio
 from datetime import datetime
 import json
 import os
+from time import perf_counter
 
 from discord import Embed
 from discord.ext import commands
-from discord.utils import get
 
-bot = commands.Bot(command_prefix="b!")
+from utils.config_store import ConfigStore
+from utils.instrumentation import Stats
+from utils.raid import JoinRateDetector
+from utils.report_store import ReportStore
+from utils.scheduler import QueueFull, Scheduler
+from utils.unverified_gate import UnverifiedGate
+from utils.welcome import JoinCoalescer, TextAsset
+
+# Shard layout is handed down by launcher.py, a standalone process lets Discord pick the shard count
+shard_count = int(os.environ['BOT_SHARD_COUNT']) if 'BOT_SHARD_COUNT' in os.environ else None
+shard_ids = [int(shard) for shard in os.environ['BOT_SHARD_IDS'].split(',')] if 'BOT_SHARD_IDS' in os.environ else None
+bot = commands.AutoShardedBot(command_prefix="b!", shard_count=shard_count, shard_ids=shard_ids)
+# Per guild locks for shared state and fair queueing of expensive commands across guilds
+bot.scheduler = Scheduler(workers=4, queue_limit=5, per_guild=1)
+# Channel archives can run for hours, they get slots of their own instead of holding the shared ones
+bot.archive_scheduler = Scheduler(workers=2, queue_limit=2, per_guild=1)
+# 10 joins within 10 seconds puts a server into lockdown for 10 minutes
+bot.raid_detector = JoinRateDetector(threshold=10, window=10, duration=600)
+# Role assignments of joins during a lockdown wait here instead of all hitting the API at once
+lockdown_role_slots = asyncio.Semaphore(3)
+# Latency histograms and REST call counts, shown by b!stats and dumped to metrics.prom
+bot.stats = Stats()
+bot.stats.instrument_http(bot.http)
 
 
 @bot.event
+@bot.stats.timed_event
 async def on_ready():
 	print("Ready")
-	config = json.loads(open('config.json', 'r').read())
-	# Check if there are any new servers the bot does not have configs for
+	# Check if there are any new servers the bot does not have configs for, new configs are
+	# batched by the config store into a single write
 	for server in bot.guilds:
-		if str(server.id) not in config:
-			# Add empty config to JSON + initialize all win/loss stats for users
-			config[server.id] = {
-									"verification_channel": None,
-									"verification_role": None,
-									"reporting_channel": None,
-									"reports": {}
-								}
-			# Save to config file
-			json.dump(config, open('config.json', 'w'), indent=2, separators=(',', ': '))
+		if not bot.config_store.has_guild(server.id):
+			bot.config_store.add_guild(server.id)
+		bot.unverified_gate.build(server)
+
+
+async def process_commands(message):
+	# Same as bot.process_commands, but records the latency of every invoked command
+	if message.author.bot:
+		return
+	ctx = await bot.get_context(message)
+	if ctx.command is None:
+		await bot.invoke(ctx)
+		return
+	start = perf_counter()
+	try:
+		await bot.invoke(ctx)
+	finally:
+		name = ctx.command.qualified_name
+		bot.stats.commands[name].observe(perf_counter() - start)
+		if ctx.command_failed:
+			bot.stats.command_errors[name] += 1
 
 
 @bot.event
+@bot.stats.timed_event
 async def on_message(message):
 	if message.guild is None:
-		await bot.process_commands(message)
+		await process_commands(message)
 		return
-	config_full = json.loads(open('config.json', 'r').read())
-	config = config_full[str(message.guild.id)]
-	verification_enabled = True if config["verification_channel"] is not None else False
-	if message.author != bot.user and verification_enabled:
-		# Check if the user is attempting to verify, if not then delete the message and send them a notice in DM
-		verify_channel = config['verification_channel']
-		unverified_role = get(message.author.guild.roles, name="Unverified")
-		if unverified_role in message.author.roles and (message.channel.id != verify_channel and message.content != "b!verify"):
-			await message.channel.purge(limit=1)
+	# Unverified users may only attempt to verify, delete anything else and send them a notice in DM
+	if bot.unverified_gate.blocks(message, bot.user):
+		await message.delete()
+		if bot.unverified_gate.should_notify(message.author.id):
 			await message.author.send(
 				"You have not verified your account, please type 'b!verify' in your server's verification channel")
-	await bot.process_commands(message)
+	await process_commands(message)
 
 
-@bot.event
-async def on_member_join(member):
-	config_full = json.loads(open('config.json', 'r').read())
-	config = config_full[str(member.guild.id)]
-	verification_enabled = True if config["verification_channel"] is not None else False
-	if verification_enabled and not member.bot:
-		role = get(member.guild.roles, id=config["verification_role"])
-		await member.add_roles(role)
+# Embed templates and the welcome DM are built once and reused for every join/leave
+WELCOME_TEMPLATE = Embed(color=0x9370DB)
+GOODBYE_TEMPLATE = Embed(color=0x9370DB, description=f'Goodbye! Thank you for spending time with us!')
+welcome_text = TextAsset('assets/welcome_message.txt')
+join_coalescer = JoinCoalescer(window=5)
 
-	message = open('assets/welcome_message.txt').read()
-	await member.send(message)
 
-	# Prepare welcome embed
-	embed = Embed(
-					color=0x9370DB,
-					description=f'Welcome to the server! You are member number {len(list(member.guild.members))}'
-				)
+def member_embed(template, member):
+	embed = template.copy()
 	embed.set_thumbnail(url=member.avatar_url)
 	embed.set_author(name=member.name, icon_url=member.avatar_url)
 	embed.set_footer(text=member.guild, icon_url=member.guild.icon_url)
 	embed.timestamp = datetime.utcnow()
+	return embed
 
-	# Get the server message channel and send welcome message there
-	channel = bot.get_channel(id=member.guild.system_channel.id)
 
+async def post_welcome(guild, members):
+	# Post in the server's system message channel, a single embed per burst of joins
+	channel = guild.system_channel
+	if channel is None:
+		return
+	if len(members) == 1:
+		embed = member_embed(WELCOME_TEMPLATE, members[0])
+		embed.description = f'Welcome to the server! You are member number {guild.member_count}'
+	else:
+		names = ', '.join(member.name for member in members[:30])
+		if len(members) > 30:
+			names += f' and {len(members) - 30} more'
+		embed = WELCOME_TEMPLATE.copy()
+		embed.description = f'Welcome to the server, {len(members)} new members! ' \
+			f'We are now {guild.member_count} strong\n{names}'
+		embed.set_footer(text=guild, icon_url=guild.icon_url)
+		embed.timestamp = datetime.utcnow()
 	await channel.send(embed=embed)
 
 
+# How the max_concurrency bucket of a command reads in the "already running" notice
+CONCURRENCY_SCOPES = {
+	commands.BucketType.user: 'for you',
+	commands.BucketType.member: 'for you',
+	commands.BucketType.channel: 'in this channel',
+	commands.BucketType.guild: 'in this server'
+}
+
+
+@bot.listen('on_command_error')
+async def on_scheduling_error(ctx, error):
+	# Added as a listener so the default error handling still runs for everything else
+	error = getattr(error, 'original', error)
+	if isinstance(error, commands.MaxConcurrencyReached):
+		scope = CONCURRENCY_SCOPES.get(error.per, 'right now')
+		await ctx.send(f'That command is already running {scope}, please wait for it to finish')
+	elif isinstance(error, QueueFull):
+		await ctx.send(str(error))
+
+
+async def announce_lockdown(guild):
+	config = bot.config_store.guild(guild.id)
+	channel = guild.get_channel(config["reporting_channel"]) if config["reporting_channel"] is not None else None
+	if channel is not None:
+		await channel.send(
+			f'Raid detected: {bot.raid_detector.threshold} or more joins within {bot.raid_detector.window} seconds. '
+			f'The server is in lockdown, welcome messages are suspended until joins calm down. '
+			f'Use b!lockdown false to lift it early.')
+
+
 @bot.event
-async def on_member_remove(member):
-	# Prepare goodbye embed
-	embed = Embed(color=0x9370DB, description=f'Goodbye! Thank you for spending time with us!')
-	embed.set_thumbnail(url=member.avatar_url)
-	embed.set_author(name=member.name, icon_url=member.avatar_url)
-	embed.set_footer(text=member.guild, icon_url=member.guild.icon_url)
-	embed.timestamp = datetime.utcnow()
+@bot.stats.timed_event
+async def on_member_join(member):
+	if bot.raid_detector.record(member.guild.id):
+		await announce_lockdown(member.guild)
+	locked = bot.raid_detector.locked(member.guild.id)
 
-	# Get the server message channel and send goodbye message there
-	channel = bot.get_channel(id=member.guild.system_channel.id)
+	config = bot.config_store.guild(member.guild.id)
+	verification_enabled = True if config["verification_channel"] is not None else False
+	if verification_enabled and not member.bot:
+		role = member.guild.get_role(config["verification_role"])
+		bot.unverified_gate.add(member)
+		if locked:
+			async with lockdown_role_slots:
+				await member.add_roles(role)
+		else:
+			await member.add_roles(role)
+
+	# During a lockdown the welcome DM and embed are skipped to save the rate limit for moderation
+	if locked:
+		return
+	await member.send(welcome_text.read())
+	await join_coalescer.joined(member, post_welcome)
 
-	await channel.send(embed=embed)
+
+@bot.event
+@bot.stats.timed_event
+async def on_member_update(before, after):
+	if before.roles != after.roles:
+		bot.unverified_gate.member_updated(before, after)
 
 
 @bot.event
+@bot.stats.timed_event
+async def on_member_remove(member):
+	bot.unverified_gate.remove(member)
+	# Raiders being kicked or banned during a lockdown would otherwise get a goodbye post each
+	if bot.raid_detector.locked(member.guild.id):
+		return
+	channel = member.guild.system_channel
+	if channel is not None:
+		await channel.send(embed=member_embed(GOODBYE_TEMPLATE, member))
+
+
+@bot.event
+@bot.stats.timed_event
 async def on_guild_join(guild):
-	config = json.loads(open('config.json', 'r').read())
-	# Create configuration dict to store in JSON
-	config[str(guild.id)] = {
-		"verification_channel": None,
-		"verification_role": None,
-		"reporting_channel": None,
-		"reports": {}
-	}
-	# Save to config file
-	json.dump(config, open('config.json', 'w'), indent=2, separators=(',', ': '))
+	# Create configuration for the new server
+	bot.config_store.add_guild(guild.id)
+	bot.unverified_gate.build(guild)
 
 
 @bot.event
+@bot.stats.timed_event
 async def on_guild_remove(guild):
-	config = json.loads(open('config.json', 'r').read())
-	config.pop(str(guild.id))
-	json.dump(config, open('config.json', 'w'), indent=2, separators=(',', ': '))
+	bot.config_store.remove_guild(guild.id)
+	bot.unverified_gate.drop(guild)
+
+
+def open_stores(config_path='config.json', reports_path='reports.db'):
+	# Parse config.json once, every cog and event shares this copy
+	bot.config_store = ConfigStore(config_path)
+	bot.config_store.on_write = bot.stats.config_io.observe
+	bot.report_store = ReportStore(reports_path)
+	# Reports used to be stored inside config.json, move any leftovers into the report store
+	bot.report_store.migrate_from_config(bot.config_store)
+	bot.unverified_gate = UnverifiedGate(bot.config_store)
 
 
 if __name__ == '__main__':
@@ -120,10 +222,18 @@ if __name__ == '__main__':
 		token = input('It appears this is the first time running the bot. Please enter your bot\'s token: ')
 		initial_config = {"token": token}
 		json.dump(initial_config, open('config.json', 'w'), indent=2, separators=(',', ': '))
-		os.mkdir('./assets/network_charts')
-		os.mkdir('./assets/role_charts')
 	finally:
-		for file in os.listdir('./cogs'):
+		open_stores()
+		load_times = {}
+		for file in sorted(os.listdir('./cogs')):
 			if file.endswith('.py'):
+				start = perf_counter()
 				bot.load_extension(f'cogs.{file[:-3]}')
+				load_times[file[:-3]] = perf_counter() - start
+		# Startup timing report, slowest cog first
+		print(f'Loaded {len(load_times)} cogs in {sum(load_times.values()):.3f}s')
+		for cog, seconds in sorted(load_times.items(), key=lambda item: item[1], reverse=True):
+			print(f'  {cog:<16}{seconds:.3f}s')
 		bot.run(token)
+		# Write out anything still waiting in the write-behind batch
+		bot.config_store.flush_sync()
@@ -0,0 +1,29 @@
+import asyncio
+
+from utils.chart_cache import ChartCache
+
+
+def test_waiters_render_again_when_first_caller_is_cancelled(tmp_path):
+	cache = ChartCache(str(tmp_path))
+	started = asyncio.Event()
+	renders = []
+
+	async def render():
+		renders.append(len(renders))
+		if len(renders) == 1:
+			started.set()
+			await asyncio.sleep(10)
+		return b'png'
+
+	async def scenario():
+		first = asyncio.ensure_future(cache.get_or_render('key', render))
+		await started.wait()
+		waiter = asyncio.ensure_future(cache.get_or_render('key', render))
+		await asyncio.sleep(0)
+		first.cancel()
+		return await asyncio.wait_for(waiter, timeout=1)
+
+	path = asyncio.run(scenario())
+	assert open(path, 'rb').read() == b'png'
+	assert len(renders) == 2
+	assert not cache.pending
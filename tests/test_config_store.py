@@ -0,0 +1,31 @@
+import json
+
+from utils.config_store import ConfigStore
+from utils.report_store import ReportStore
+
+
+def test_migration_keeps_changes_made_after_a_stale_load(tmp_path):
+	path = str(tmp_path / 'config.json')
+	legacy = {"verification_channel": None, "verification_role": None, "reporting_channel": None, "reports": {
+		"1": {"report_id": 1, "action": "Warning", "body": "legacy", "issuer": "mod#0001", "subject": "user#0001"}
+	}}
+	with open(path, 'w') as file:
+		json.dump({"token": "not-a-token", "1": legacy, "2": legacy}, file)
+	# Two shard processes load the file, the second one only migrates after the first changed a guild
+	stale = ConfigStore(path)
+	running = ConfigStore(path)
+	running.update(2, reporting_channel=5)
+	running.remove_guild(1)
+
+	reports = ReportStore(str(tmp_path / 'reports.db'))
+	try:
+		reports.migrate_from_config(stale)
+	finally:
+		reports.close()
+
+	with open(path) as file:
+		config = json.load(file)
+	assert "1" not in config
+	assert config["2"]["reporting_channel"] == 5
+	assert "reports" not in config["2"]
+	assert config["token"] == "not-a-token"
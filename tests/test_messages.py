@@ -0,0 +1,42 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from discord.ext import commands
+
+from cogs.messages import parse_purge_filters
+
+
+def message(content='', bot=False, attachments=()):
+	return SimpleNamespace(content=content, author=SimpleNamespace(bot=bot), attachments=list(attachments))
+
+
+def matches(checks, candidate):
+	return all(check(candidate) for check in checks)
+
+
+def test_regex_keeps_backslashes():
+	_, checks = parse_purge_filters(r'--regex \d+')
+	assert matches(checks, message('order 66'))
+	assert not matches(checks, message('good day'))
+
+
+def test_quoted_regex_and_apostrophes():
+	_, checks = parse_purge_filters('--regex "free nitro" --bots')
+	assert matches(checks, message('get free nitro here', bot=True))
+	assert not matches(checks, message('get free nitro here'))
+	_, checks = parse_purge_filters("--regex don't")
+	assert matches(checks, message("don't do that"))
+
+
+def test_attachments_and_age_bounds():
+	bounds, checks = parse_purge_filters('--attachments --newer 10 --older 5')
+	assert bounds['after'] < bounds['before'] < datetime.utcnow()
+	assert matches(checks, message(attachments=['file']))
+	assert not matches(checks, message())
+
+
+@pytest.mark.parametrize('options', ['--regex "unclosed', '--regex (', '--newer soon', '--everything'])
+def test_invalid_options_are_bad_arguments(options):
+	with pytest.raises(commands.BadArgument):
+		parse_purge_filters(options)
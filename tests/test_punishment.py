@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+from discord import Forbidden, NotFound
+
+from cogs.punishment import Punishment, report_record, user_name
+from utils.report_store import ReportStore
+
+
+def stub_user(user_id, name):
+	return SimpleNamespace(id=user_id, name=name, discriminator='0001', send=AsyncMock())
+
+
+class StubConfigStore:
+
+	def guild(self, guild_id):
+		return {"reporting_channel": None}
+
+
+def test_user_name():
+	assert user_name(stub_user(1, 'moderator')) == 'moderator#0001'
+
+
+def test_report_record():
+	record = report_record('Ban', 'spam', stub_user(1, 'moderator'), stub_user(2, 'spammer'))
+	assert record == {
+		"action": 'Ban',
+		"issuer_id": 1,
+		"issuer": 'moderator#0001',
+		"subject_id": 2,
+		"subject": 'spammer#0001',
+		"body": 'spam'
+	}
+
+
+def moderation_context():
+	issuer, target = stub_user(1, 'moderator'), stub_user(2, 'spammer')
+	guild = SimpleNamespace(id=10, name='guild')
+	ctx = SimpleNamespace(message=SimpleNamespace(guild=guild, author=issuer), send=AsyncMock())
+	return ctx, issuer, target
+
+
+def test_moderate_files_report_and_applies_action(tmp_path):
+	store = ReportStore(str(tmp_path / 'reports.db'))
+	try:
+		cog = Punishment(SimpleNamespace(config_store=StubConfigStore(), report_store=store))
+		ctx, issuer, target = moderation_context()
+		apply = AsyncMock()
+
+		report = asyncio.run(cog.moderate(ctx, target, 'Ban', 'spam', 'banned', apply))
+
+		apply.assert_awaited_once()
+		target.send.assert_awaited_once()
+		issuer.send.assert_awaited_once()
+		assert report.report_number == 1
+		assert store.get(10, 1)["subject"] == 'spammer#0001'
+	finally:
+		store.close()
+
+
+def test_moderate_withdraws_report_when_action_fails(tmp_path):
+	store = ReportStore(str(tmp_path / 'reports.db'))
+	try:
+		cog = Punishment(SimpleNamespace(config_store=StubConfigStore(), report_store=store))
+		ctx, issuer, target = moderation_context()
+		apply = AsyncMock(side_effect=Forbidden(SimpleNamespace(status=403, reason='Forbidden'), 'Missing Permissions'))
+
+		report = asyncio.run(cog.moderate(ctx, target, 'Ban', 'spam', 'banned', apply))
+
+		assert report is None
+		assert store.get(10, 1) is None
+		assert 'Missing Permissions' in ctx.send.await_args.args[0]
+		issuer.send.assert_not_awaited()
+	finally:
+		store.close()
+
+
+def test_lookup_falls_back_to_ids_when_user_cannot_be_fetched(tmp_path):
+	store = ReportStore(str(tmp_path / 'reports.db'))
+	try:
+		# A migrated report only carries names, so lookup has to resolve the user
+		store._write_sync(store._import_legacy, {"10": {"1": {
+			"report_id": 1, "action": "Warning", "body": "legacy", "issuer": "mod#0001", "subject": "gone#0001"}}})
+		asyncio.run(store.add(10, report_record('Ban', 'spam', stub_user(1, 'moderator'), stub_user(int('2' * 18), 'gone'))))
+		not_found = NotFound(SimpleNamespace(status=404, reason='Not Found'), 'Unknown User')
+		bot = SimpleNamespace(
+			config_store=StubConfigStore(), report_store=store,
+			get_user=lambda user_id: None, fetch_user=AsyncMock(side_effect=not_found))
+		cog = Punishment(bot)
+		guild = SimpleNamespace(id=10, name='guild')
+		ctx = SimpleNamespace(message=SimpleNamespace(guild=guild, mentions=[]), send=AsyncMock())
+
+		asyncio.run(cog.lookup.callback(cog, ctx, args='2' * 18))
+
+		embed = ctx.send.await_args.kwargs['embed']
+		assert embed.description == '1 reports found'
+	finally:
+		store.close()
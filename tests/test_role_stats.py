@@ -0,0 +1,43 @@
+import asyncio
+from collections import Counter
+from itertools import combinations
+
+from benchmarks.fakes import synthetic_guild
+from utils.role_stats import RoleStatsIndex, member_role_ids
+
+
+def brute_force(guild):
+	counts, pairs = Counter(), Counter()
+	for member in guild.members:
+		roles = sorted(member_role_ids(member))
+		counts.update(roles)
+		pairs.update(combinations(roles, 2))
+	return counts, pairs
+
+
+def test_build_matches_pair_counting():
+	guild = synthetic_guild(10 ** 9, 2000, 40, 0.2)
+	stats = asyncio.run(RoleStatsIndex().build(guild))
+	counts, pairs = brute_force(guild)
+	assert +stats.counts == counts
+	assert set(stats.counts) == {role.id for role in guild.roles if not role.is_default()}
+	assert stats.pairs == pairs
+
+
+def test_events_during_build_are_replayed():
+	guild = synthetic_guild(10 ** 9, 500, 20, 0.3)
+	counts, _ = brute_force(guild)
+	leaving = guild.members[0]
+
+	async def build_with_event():
+		index = RoleStatsIndex()
+		build = asyncio.ensure_future(index.build(guild))
+		while guild.id not in index.pending:
+			await asyncio.sleep(0)
+		index.member_left(leaving)
+		await build
+		return index.guilds[guild.id]
+
+	stats = asyncio.run(build_with_event())
+	for role_id in member_role_ids(leaving):
+		assert stats.counts[role_id] == counts[role_id] - 1
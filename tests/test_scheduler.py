@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from utils.scheduler import QueueFull, Scheduler
+
+
+async def job(scheduler, guild_id, log, duration=0.01):
+	async with scheduler.heavy(guild_id):
+		log.append(('start', guild_id))
+		await asyncio.sleep(duration)
+		log.append(('end', guild_id))
+
+
+def test_one_guild_can_not_take_every_slot():
+	async def scenario():
+		scheduler = Scheduler(workers=4, queue_limit=5, per_guild=1)
+		log = []
+		jobs = [asyncio.ensure_future(job(scheduler, 'a', log)) for _ in range(4)]
+		await asyncio.sleep(0)
+		jobs.append(asyncio.ensure_future(job(scheduler, 'b', log)))
+		await asyncio.gather(*jobs)
+		return scheduler, log
+
+	scheduler, log = asyncio.run(scenario())
+	starts = [guild_id for event, guild_id in log if event == 'start']
+	assert starts[:2] == ['a', 'b']
+	assert scheduler.running == 0 and not scheduler.running_by_guild and not scheduler.queues
+
+
+def test_free_slots_go_round_robin_across_guilds():
+	async def scenario():
+		scheduler = Scheduler(workers=1, queue_limit=5, per_guild=1)
+		log = []
+		jobs = [asyncio.ensure_future(job(scheduler, guild_id, log)) for guild_id in 'aaabbc']
+		await asyncio.gather(*jobs)
+		return log
+
+	starts = [guild_id for event, guild_id in asyncio.run(scenario()) if event == 'start']
+	assert starts == ['a', 'b', 'c', 'a', 'b', 'a']
+
+
+def test_queue_limit_and_cancelled_waiters():
+	async def scenario():
+		scheduler = Scheduler(workers=1, queue_limit=1, per_guild=1)
+		log = []
+		running = asyncio.ensure_future(job(scheduler, 'a', log, duration=0.05))
+		await asyncio.sleep(0)
+		waiting = asyncio.ensure_future(job(scheduler, 'a', log))
+		await asyncio.sleep(0)
+		with pytest.raises(QueueFull):
+			await job(scheduler, 'a', log)
+		waiting.cancel()
+		await asyncio.gather(running, waiting, return_exceptions=True)
+		await job(scheduler, 'a', log)
+		return scheduler, log
+
+	scheduler, log = asyncio.run(scenario())
+	assert log.count(('start', 'a')) == 2
+	assert scheduler.running == 0 and not scheduler.queues
@@ -0,0 +1,11 @@
+from benchmarks.shards import smoke_test
+from launcher import shard_ranges
+
+
+def test_shard_ranges_cover_every_shard_once():
+	assert shard_ranges(3, 8) == [[0, 1, 2], [3, 4, 5], [6, 7]]
+	assert shard_ranges(4, 2) == [[0], [1]]
+
+
+def test_shard_processes_share_config_and_reports():
+	assert smoke_test(processes=2, shards=4, guilds=16, rounds=5) == []
@@ -0,0 +1,26 @@
+from benchmarks.fakes import FakeChannel, FakeMessage, synthetic_guild
+from utils.unverified_gate import UnverifiedGate
+
+
+class StubConfigStore:
+
+	def __init__(self, guild):
+		self.config = {"verification_channel": guild.channels[0].id, "verification_role": guild.roles[1].id}
+
+	def guild(self, guild_id):
+		return self.config
+
+
+def test_blocks_only_unverified_members_outside_verification():
+	guild = synthetic_guild(10 ** 9, 200, 10, 0.2, unverified=0.5)
+	gate = UnverifiedGate(StubConfigStore(guild))
+	gate.build(guild)
+	unverified = guild.roles[1].members[0]
+	verified = next(member for member in guild.members if member not in guild.roles[1].members)
+	general = FakeChannel(guild.id + 100, guild)
+
+	assert gate.blocks(FakeMessage(1, unverified, general, 'hello'), None)
+	assert not gate.blocks(FakeMessage(2, unverified, general, 'b!verify'), None)
+	assert not gate.blocks(FakeMessage(3, unverified, guild.channels[0], 'hello'), None)
+	assert not gate.blocks(FakeMessage(4, verified, general, 'hello'), None)
+	assert not gate.blocks(FakeMessage(5, unverified, general, 'hello'), unverified)
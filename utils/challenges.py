@@ -0,0 +1,81 @@
+from collections import deque, namedtuple
+from random import choice, choices, randint, sample
+
+from utils.files import write_atomic
+
+WORD_LIST_URL = "https://www.mit.edu/~ecprice/wordlist.10000"
+WORD_LIST_PATH = './assets/wordlist.txt'
+
+IMAGE_ANSWER_PAIRING = [
+	['blue', './assets/blue.jpg'],
+	['red', './assets/red.jpg'],
+	['white', './assets/white.jpg'],
+	['black', './assets/black.jpg']
+]
+
+# image is the path of the file to attach, or None
+Challenge = namedtuple('Challenge', 'prompt answer image')
+
+
+def load_word_list(path=WORD_LIST_PATH):
+	try:
+		with open(path) as file:
+			return [word for word in file.read().splitlines() if word]
+	except FileNotFoundError:
+		return []
+
+
+def save_word_list(text, path=WORD_LIST_PATH):
+	write_atomic(path, text)
+
+
+def obfuscate(phrase):
+	insertion_point = randint(1, len(phrase) - 2)
+	return f'{phrase[:insertion_point+1]}' \
+			f'​{phrase[insertion_point+1:]}' \
+			f''.replace('o', 'ο').replace('e', 'е').replace('a', 'а').replace('i', 'і')
+
+
+def image_challenge():
+	answer, image = choice(IMAGE_ANSWER_PAIRING)
+	prompt = obfuscate('( Pillows are so comfy 😊)')
+	return Challenge(
+		f"Please reply with the following single word basic color displayed on the pillow: {prompt}", answer, image)
+
+
+def math_challenge():
+	phrase = f'{randint(1,9)}{choice(["+","-","*"])}{randint(1,9)}{choice(["+","-","*"])}{randint(1,9)}'
+	return Challenge(f"Please reply with the following computation: {obfuscate(phrase)}", str(eval(phrase)), None)
+
+
+def phrase_challenge(words):
+	# Pick three random words for the user to type back
+	phrase = ' '.join(choices(words, k=3))
+	return Challenge(f"Please reply with the following phrase: {obfuscate(phrase)}", phrase, None)
+
+
+class ChallengePool:
+	"""Ready made verification challenges so verify never has to build one (or fetch words) inline"""
+
+	def __init__(self, size=100, word_cache_size=1000):
+		self.size = size
+		self.word_cache_size = word_cache_size
+		self.words = []
+		self.challenges = deque()
+
+	def set_words(self, words):
+		self.words = sample(words, min(self.word_cache_size, len(words)))
+
+	def generate(self):
+		# Without a word list (first start while offline) only the math and image challenges are possible
+		makers = [image_challenge, math_challenge]
+		if self.words:
+			makers.append(lambda: phrase_challenge(self.words))
+		return choice(makers)()
+
+	def top_up(self):
+		while len(self.challenges) < self.size:
+			self.challenges.append(self.generate())
+
+	def take(self):
+		return self.challenges.popleft() if self.challenges else self.generate()
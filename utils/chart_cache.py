@@ -0,0 +1,99 @@
+import asyncio
+from collections import OrderedDict
+from hashlib import sha256
+import json
+import os
+
+from utils.files import write_atomic
+
+
+class ChartCache:
+	"""Rendered charts on disk, keyed by a fingerprint of everything that goes into the render.
+
+	Least recently used files are evicted once max_entries or max_bytes is exceeded,
+	and concurrent requests for the same key share a single render."""
+
+	def __init__(self, directory='./assets/chart_cache', max_entries=256, max_bytes=64 * 1024 * 1024):
+		self.directory = directory
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.entries = OrderedDict()
+		self.total_bytes = 0
+		self.pending = {}
+		os.makedirs(directory, exist_ok=True)
+		self._load_existing()
+
+	def _load_existing(self):
+		# Pick up charts rendered before a restart, oldest first so they are evicted first
+		files = []
+		for name in os.listdir(self.directory):
+			path = os.path.join(self.directory, name)
+			if name.endswith('.tmp'):
+				os.remove(path)
+			elif name.endswith('.png'):
+				files.append((os.path.getmtime(path), name[:-4], os.path.getsize(path)))
+		for _, key, size in sorted(files):
+			self.entries[key] = size
+			self.total_bytes += size
+		self._evict()
+
+	@staticmethod
+	def fingerprint(*parts):
+		return sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+	def path(self, key):
+		return os.path.join(self.directory, f'{key}.png')
+
+	def get(self, key):
+		if key not in self.entries:
+			return None
+		self.entries.move_to_end(key)
+		return self.path(key)
+
+	async def put(self, key, data):
+		await asyncio.get_running_loop().run_in_executor(None, write_atomic, self.path(key), data)
+		self.total_bytes += len(data) - self.entries.pop(key, 0)
+		self.entries[key] = len(data)
+		self._evict()
+		return self.path(key)
+
+	def _evict(self):
+		while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+			key, size = self.entries.popitem(last=False)
+			self.total_bytes -= size
+			try:
+				os.remove(self.path(key))
+			except FileNotFoundError:
+				pass
+
+	async def get_or_render(self, key, render):
+		"""Return the path of the cached chart, awaiting render() for the PNG bytes on a miss"""
+		path = self.get(key)
+		if path is not None:
+			return path
+		pending = self.pending.get(key)
+		if pending is not None:
+			try:
+				return await asyncio.shield(pending)
+			except asyncio.CancelledError:
+				# The render was cancelled along with the caller that started it, start over unless
+				# this caller is the one being cancelled
+				if not pending.cancelled():
+					raise
+			return await self.get_or_render(key, render)
+		future = asyncio.get_running_loop().create_future()
+		self.pending[key] = future
+		try:
+			path = await self.put(key, await render())
+			future.set_result(path)
+			return path
+		except Exception as error:
+			future.set_exception(error)
+			# Nobody else may be waiting, don't let the exception go unretrieved
+			future.exception()
+			raise
+		finally:
+			del self.pending[key]
+			# Cancelled (a BaseException), release the waiters instead of leaving them hanging
+			if not future.done():
+				future.cancel()
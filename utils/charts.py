@@ -0,0 +1,112 @@
+"""Chart rendering jobs, run inside worker processes.
+
+Jobs only receive plain role/member data and return the rendered PNG as bytes,
+so nothing discord related has to be pickled across the process boundary."""
+from io import BytesIO
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import matplotlib.pyplot as plt
+import networkx as nx
+import numpy as np
+
+from utils.cooccurrence import cooccurrence_from_counts, graph_data
+
+ROLES_PER_PAGE = 60
+ROLE_CHART_SIZE = (24, 12)
+_figure = None
+
+
+def _to_png(figure):
+	buffer = BytesIO()
+	figure.savefig(buffer, format='PNG')
+	plt.close(figure)
+	return buffer.getvalue()
+
+
+def role_summary(counts):
+	"""Mean, sample standard deviation and quartiles of the role member counts"""
+	values = np.asarray(counts, dtype=np.float64)
+	if not values.size:
+		return 0.0, 0.0, 0.0, 0.0
+	lower, upper = np.percentile(values, [25, 75])
+	std = values.std(ddof=1) if values.size > 1 else 0.0
+	return values.mean(), std, lower, upper
+
+
+def _role_figure():
+	# One Agg figure per worker process, cleared and reused for every render
+	global _figure
+	if _figure is None:
+		_figure = Figure(figsize=ROLE_CHART_SIZE)
+		FigureCanvasAgg(_figure)
+	_figure.clear()
+	return _figure
+
+
+def role_chart_pages(role_count):
+	return max(1, -(-role_count // ROLES_PER_PAGE))
+
+
+def render_role_chart(guild_name, role_counts, date, page=1):
+	"""role_counts maps role name -> number of members holding it. Roles are shown largest
+	first, ROLES_PER_PAGE at a time so the canvas stays the same size for any guild"""
+	ranked = sorted(role_counts.items(), key=lambda item: item[1], reverse=True)
+	mean, std, lower, upper = role_summary([count for _, count in ranked])
+	pages = role_chart_pages(len(ranked))
+	page = min(max(page, 1), pages)
+	shown = ranked[(page - 1) * ROLES_PER_PAGE:page * ROLES_PER_PAGE]
+
+	figure = _role_figure()
+	axes = figure.add_subplot()
+	axes.bar(range(len(shown)), [count for _, count in shown], width=.2)
+	axes.set_xticks(range(len(shown)))
+	axes.set_xticklabels([name for name, _ in shown], rotation=90, fontsize=12)
+	axes.tick_params(axis='y', labelsize=12)
+	page_note = f' (page {page}/{pages})' if pages > 1 else ''
+	axes.set_title(
+		f"{guild_name} roles on {date}{page_note}\n"
+		f"Average: {round(mean, 4)}  Std. Dev: {round(std, 4)}\n"
+		f"Higher Quartile: {upper}  Lower Quartile: {lower}"
+	)
+	figure.tight_layout()
+	buffer = BytesIO()
+	figure.savefig(buffer, format='PNG')
+	return buffer.getvalue()
+
+
+def render_network_chart(guild_name, roles, counts, pairs):
+	"""roles is the list of role names, counts the member count of each role and pairs
+	(role index, role index, members holding both) triples"""
+	matrix = cooccurrence_from_counts(counts, pairs)
+	node_list, edge_list = graph_data(matrix, roles)
+
+	# set canvas size
+	figure, _ = plt.subplots(figsize=(14, 14))
+
+	# networkx graph time!
+	graph = nx.Graph()
+	for i in sorted(node_list):
+		graph.add_node(i[0], size=i[1])
+	graph.add_weighted_edges_from(edge_list)
+
+	# Drawing customization
+	node_scalar = 1600
+	edge_scalar = 20
+	sizes = [graph.nodes[node]['size'] * node_scalar for node in graph.nodes]
+	widths = [graph.edges[edge]['weight'] * edge_scalar for edge in graph.edges]
+
+	# Draw the graph
+	pos = nx.spring_layout(graph, k=0.42, iterations=17)
+	plt.title(f'{guild_name} role co-occurrence graph')
+	nx.draw(
+				graph, pos,
+				with_labels=True,
+				font_size=8,
+				font_weight='bold',
+				node_size=sizes,
+				width=widths
+			)
+	return _to_png(figure)
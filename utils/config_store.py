@@ -0,0 +1,167 @@
+import asyncio
+from contextlib import contextmanager
+import copy
+import json
+from time import perf_counter
+
+from utils.files import write_atomic
+
+try:
+	import fcntl
+except ImportError:
+	# Windows, only a single bot process is supported there
+	fcntl = None
+
+
+def default_guild_config():
+	return {
+		"verification_channel": None,
+		"verification_role": None,
+		"reporting_channel": None
+	}
+
+
+def write_config(path, data):
+	# Synced to disk, the config is the one file a crash must never lose
+	write_atomic(path, json.dumps(data, indent=2, separators=(',', ': ')), fsync=True)
+
+
+@contextmanager
+def file_lock(path):
+	# Serializes writers from several bot processes (shards) sharing the same config file
+	with open(f'{path}.lock', 'w') as lock:
+		if fcntl is not None:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+		yield
+
+
+def merge_into_file(path, updates, removals):
+	"""Apply this process' changes on top of the current file. Other processes only touch
+	the guilds of their own shards, so their entries are preserved as they are on disk"""
+	with file_lock(path):
+		try:
+			with open(path) as file:
+				current = json.load(file)
+		except FileNotFoundError:
+			current = {}
+		current.update(updates)
+		for key in removals:
+			current.pop(key, None)
+		write_config(path, current)
+
+
+def remove_field_from_file(path, keys, field):
+	"""Drop one field of the given guilds from the file, leaving the rest of their config as it is on disk"""
+	with file_lock(path):
+		with open(path) as file:
+			current = json.load(file)
+		for key in keys:
+			if isinstance(current.get(key), dict):
+				current[key].pop(field, None)
+		write_config(path, current)
+
+
+class ConfigStore:
+	"""Single in-memory copy of config.json shared by every cog and event.
+
+	The file is parsed once at startup and lookups are served from memory. Changes
+	mark their guild dirty, dirty guilds are batched over flush_delay seconds and
+	merged into the file by an executor thread."""
+
+	def __init__(self, path='config.json', flush_delay=2.0):
+		self.path = path
+		self.flush_delay = flush_delay
+		self.data = json.loads(open(path, 'r').read())
+		self._dirty = set()
+		self._flush_task = None
+		self._write_lock = None
+		# Optional callable receiving the duration in seconds of every write, for instrumentation
+		self.on_write = None
+
+	@property
+	def token(self):
+		return self.data.get('token')
+
+	def guild(self, guild_id):
+		"""Return the config dict of a guild, creating a default one if the guild is unknown"""
+		key = str(guild_id)
+		config = self.data.get(key)
+		if config is None:
+			config = self.add_guild(guild_id)
+		return config
+
+	def has_guild(self, guild_id):
+		return str(guild_id) in self.data
+
+	def add_guild(self, guild_id):
+		config = self.data.setdefault(str(guild_id), default_guild_config())
+		self.mark_dirty(guild_id)
+		return config
+
+	def remove_guild(self, guild_id):
+		if self.data.pop(str(guild_id), None) is not None:
+			self.mark_dirty(guild_id)
+
+	def update(self, guild_id, **fields):
+		"""Update fields of a guild config and persist the change"""
+		config = self.guild(guild_id)
+		config.update(**fields)
+		self.mark_dirty(guild_id)
+		return config
+
+	def remove_field(self, field, keys):
+		"""Remove a field from guilds that may belong to other shards' processes. Unlike marking them
+		dirty, this never writes this process' (possibly stale) copy of those guilds"""
+		for key in keys:
+			self.data[key].pop(field, None)
+		if keys:
+			remove_field_from_file(self.path, keys, field)
+
+	def mark_dirty(self, guild_id=None):
+		"""Queue a guild (or the whole file if no guild is given) for the next write"""
+		self._dirty.add(str(guild_id) if guild_id is not None else None)
+		try:
+			loop = asyncio.get_running_loop()
+		except RuntimeError:
+			# No running loop (e.g. during startup or shutdown), write synchronously instead
+			self.flush_sync()
+			return
+		if self._flush_task is None:
+			self._flush_task = loop.create_task(self._flush_later())
+
+	async def _flush_later(self):
+		await asyncio.sleep(self.flush_delay)
+		# Changes made while writing schedule a new batch
+		self._flush_task = None
+		await self.flush()
+
+	async def flush(self):
+		if self._write_lock is None:
+			self._write_lock = asyncio.Lock()
+		async with self._write_lock:
+			changes = self._take_changes()
+			if changes is not None:
+				start = perf_counter()
+				await asyncio.get_running_loop().run_in_executor(None, merge_into_file, self.path, *changes)
+				self._record_write(perf_counter() - start)
+
+	def flush_sync(self):
+		changes = self._take_changes()
+		if changes is not None:
+			start = perf_counter()
+			merge_into_file(self.path, *changes)
+			self._record_write(perf_counter() - start)
+
+	def _record_write(self, seconds):
+		if self.on_write is not None:
+			self.on_write(seconds)
+
+	def _take_changes(self):
+		if not self._dirty:
+			return None
+		keys = set(self.data) if None in self._dirty else self._dirty
+		# Copies, so the executor thread never serializes a dict the event loop is mutating
+		updates = {key: copy.deepcopy(self.data[key]) for key in keys if key in self.data}
+		removals = [key for key in keys if key not in self.data]
+		self._dirty = set()
+		return updates, removals
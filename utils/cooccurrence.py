@@ -0,0 +1,78 @@
+"""Role co-occurrence computed from a sparse member x role incidence matrix.
+
+With A the incidence matrix (A[m, r] == 1 when member m holds role r), A.T @ A
+is the role x role co-occurrence matrix: entry (a, b) counts the members holding
+both roles and the diagonal counts the members of each role."""
+import numpy as np
+from scipy import sparse
+
+
+def incidence_matrix(member_roles, role_count):
+	"""member_roles is an iterable with a list of role indices for every member"""
+	indptr = [0]
+	indices = []
+	for roles in member_roles:
+		indices.extend(roles)
+		indptr.append(len(indices))
+	data = np.ones(len(indices), dtype=np.int32)
+	return sparse.csr_matrix(
+		(data, np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+		shape=(len(indptr) - 1, role_count)
+	)
+
+
+def cooccurrence(incidence):
+	return (incidence.T @ incidence).tocoo()
+
+
+def role_counts(member_roles, role_count):
+	"""Member count of every role and (row, col, count) of every pair of roles held together,
+	from the role indices of every member"""
+	matrix = cooccurrence(incidence_matrix(member_roles, role_count))
+	upper = matrix.row < matrix.col
+	pairs = zip(matrix.row[upper].tolist(), matrix.col[upper].tolist(), matrix.data[upper].tolist())
+	return matrix.diagonal().tolist(), sorted(pairs)
+
+
+def cooccurrence_from_counts(counts, pairs):
+	"""Rebuild the symmetric co-occurrence matrix from per role counts (the diagonal)
+	and (row, col, count) pair counts, as kept by the role statistics index"""
+	size = len(counts)
+	diagonal = np.arange(size)
+	rows = np.asarray([pair[0] for pair in pairs], dtype=np.int32)
+	cols = np.asarray([pair[1] for pair in pairs], dtype=np.int32)
+	data = np.asarray([pair[2] for pair in pairs], dtype=np.int64)
+	return sparse.coo_matrix(
+		(
+			np.concatenate([np.asarray(counts, dtype=np.int64), data, data]),
+			(np.concatenate([diagonal, rows, cols]), np.concatenate([diagonal, cols, rows]))
+		),
+		shape=(size, size)
+	)
+
+
+def graph_data(matrix, roles, node_scale=6):
+	"""Turn a co-occurrence matrix into networkx ready node sizes and edge weights.
+
+	Both are normalised by the largest count, which is always on the diagonal
+	since no pair of roles can be held by more members than either role alone.
+	Returns ([(role, size)], [(role_a, role_b, weight)]) without zero entries
+	or self references."""
+	matrix = matrix.tocoo()
+	counts = matrix.diagonal()
+	max_weight = counts.max() if counts.size else 0
+	if not max_weight:
+		return [], []
+
+	node_indices = np.flatnonzero(counts)
+	node_sizes = counts[node_indices] / max_weight * node_scale
+	nodes = [(roles[i], size) for i, size in zip(node_indices.tolist(), node_sizes.tolist())]
+
+	# The matrix is symmetric, keep each pair once
+	upper = (matrix.row < matrix.col) & (matrix.data > 0)
+	weights = matrix.data[upper] / max_weight
+	edges = [
+		(roles[row], roles[col], weight)
+		for row, col, weight in zip(matrix.row[upper].tolist(), matrix.col[upper].tolist(), weights.tolist())
+	]
+	return nodes, edges
@@ -0,0 +1,13 @@
+import os
+
+
+def write_atomic(path, data, fsync=False):
+	"""Write text or bytes next to path and rename over it, so neither readers nor a crash ever
+	see a truncated file. fsync makes the contents durable before the rename"""
+	temp_path = f'{path}.tmp'
+	with open(temp_path, 'wb' if isinstance(data, bytes) else 'w') as file:
+		file.write(data)
+		if fsync:
+			file.flush()
+			os.fsync(file.fileno())
+	os.replace(temp_path, path)
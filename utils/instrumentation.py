@@ -0,0 +1,120 @@
+import asyncio
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from functools import wraps
+from time import monotonic, perf_counter
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+class Histogram:
+
+	def __init__(self):
+		self.buckets = [0] * len(BUCKETS)
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def observe(self, seconds):
+		self.buckets[bisect_left(BUCKETS, seconds)] += 1
+		self.count += 1
+		self.sum += seconds
+		self.max = max(self.max, seconds)
+
+	def percentile(self, fraction):
+		"""Upper bound of the bucket holding the given fraction of observations"""
+		if not self.count:
+			return 0.0
+		target = fraction * self.count
+		seen = 0
+		for bound, count in zip(BUCKETS, self.buckets):
+			seen += count
+			if seen >= target:
+				return min(bound, self.max)
+		return self.max
+
+
+def _label(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+class Stats:
+	"""Latency histograms of commands, events, event loop lag and config writes,
+	plus REST call counts per route"""
+
+	def __init__(self):
+		self.started = monotonic()
+		self.commands = defaultdict(Histogram)
+		self.command_errors = Counter()
+		self.events = defaultdict(Histogram)
+		self.loop_lag = Histogram()
+		self.config_io = Histogram()
+		self.rest_calls = Counter()
+		self.gauges = {}
+
+	def timed_event(self, handler):
+		"""Decorator recording the latency of an event handler under its name"""
+		@wraps(handler)
+		async def wrapper(*args, **kwargs):
+			start = perf_counter()
+			try:
+				return await handler(*args, **kwargs)
+			finally:
+				self.events[handler.__name__].observe(perf_counter() - start)
+		return wrapper
+
+	def instrument_http(self, http):
+		"""Count every REST call by method and route template (e.g. POST /channels/{channel_id}/messages)"""
+		request = http.request
+		if getattr(request, 'instrumented', False):
+			return
+
+		@wraps(request)
+		async def counted_request(route, **kwargs):
+			self.rest_calls[f'{route.method} {route.path}'] += 1
+			return await request(route, **kwargs)
+		counted_request.instrumented = True
+		http.request = counted_request
+
+	async def sample_loop_lag(self, interval=0.5):
+		"""Measure how late the event loop wakes up from a sleep, which is how long it was blocked"""
+		while True:
+			start = perf_counter()
+			await asyncio.sleep(interval)
+			self.loop_lag.observe(max(perf_counter() - start - interval, 0.0))
+
+	def prometheus(self):
+		"""All metrics in the Prometheus text exposition format"""
+		lines = [
+			'# TYPE bot_uptime_seconds gauge',
+			f'bot_uptime_seconds {monotonic() - self.started:.3f}'
+		]
+		histograms = [
+			('bot_command_seconds', 'command', self.commands),
+			('bot_event_seconds', 'event', self.events),
+			('bot_loop_lag_seconds', None, {None: self.loop_lag}),
+			('bot_config_write_seconds', None, {None: self.config_io})
+		]
+		for metric, label, series in histograms:
+			lines.append(f'# TYPE {metric} histogram')
+			for name, histogram in sorted(series.items(), key=lambda item: str(item[0])):
+				labels = f'{label}="{_label(name)}",' if label is not None else ''
+				cumulative = 0
+				for bound, count in zip(BUCKETS, histogram.buckets):
+					cumulative += count
+					le = '+Inf' if bound == float('inf') else repr(bound)
+					lines.append(f'{metric}_bucket{{{labels}le="{le}"}} {cumulative}')
+				plain = f'{{{labels[:-1]}}}' if labels else ''
+				lines.append(f'{metric}_sum{plain} {histogram.sum:.6f}')
+				lines.append(f'{metric}_count{plain} {histogram.count}')
+		lines.append('# TYPE bot_command_errors_total counter')
+		for name, count in sorted(self.command_errors.items()):
+			lines.append(f'bot_command_errors_total{{command="{_label(name)}"}} {count}')
+		lines.append('# TYPE bot_rest_calls_total counter')
+		for route, count in sorted(self.rest_calls.items()):
+			lines.append(f'bot_rest_calls_total{{route="{_label(route)}"}} {count}')
+		for name, value in sorted(self.gauges.items()):
+			lines.append(f'# TYPE {name} gauge')
+			lines.append(f'{name} {value}')
+		return '\n'.join(lines) + '\n'
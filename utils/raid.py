@@ -0,0 +1,47 @@
+from collections import deque
+from time import monotonic
+
+
+class JoinRateDetector:
+	"""Sliding window join rate per guild.
+
+	Only the timestamps of the last `threshold` joins are kept (a fixed size ring
+	buffer), when all of them fall within `window` seconds the guild goes into
+	lockdown. Lockdown lasts `duration` seconds and is extended while joins keep
+	spiking."""
+
+	def __init__(self, threshold=10, window=10.0, duration=600.0):
+		self.threshold = threshold
+		self.window = window
+		self.duration = duration
+		self.joins = {}
+		self.lockdowns = {}
+
+	def record(self, guild_id, now=None):
+		"""Record a join, returns True if it just put the guild into lockdown"""
+		now = monotonic() if now is None else now
+		joins = self.joins.get(guild_id)
+		if joins is None:
+			joins = self.joins[guild_id] = deque(maxlen=self.threshold)
+		joins.append(now)
+		if len(joins) == self.threshold and now - joins[0] <= self.window:
+			started = not self.locked(guild_id, now)
+			self.lockdowns[guild_id] = now + self.duration
+			return started
+		return False
+
+	def locked(self, guild_id, now=None):
+		expires = self.lockdowns.get(guild_id)
+		if expires is None:
+			return False
+		if (monotonic() if now is None else now) < expires:
+			return True
+		del self.lockdowns[guild_id]
+		return False
+
+	def lock(self, guild_id, duration=None):
+		self.lockdowns[guild_id] = monotonic() + (self.duration if duration is None else duration)
+
+	def lift(self, guild_id):
+		self.lockdowns.pop(guild_id, None)
+		self.joins.pop(guild_id, None)
@@ -0,0 +1,197 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import sqlite3
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+	guild_id INTEGER NOT NULL,
+	report_id INTEGER NOT NULL,
+	action TEXT NOT NULL,
+	body TEXT NOT NULL,
+	issuer_id INTEGER,
+	issuer TEXT NOT NULL,
+	subject_id INTEGER,
+	subject TEXT NOT NULL,
+	created_at TEXT,
+	PRIMARY KEY (guild_id, report_id)
+);
+CREATE INDEX IF NOT EXISTS reports_subject_id ON reports (guild_id, subject_id);
+CREATE INDEX IF NOT EXISTS reports_issuer_id ON reports (guild_id, issuer_id);
+CREATE INDEX IF NOT EXISTS reports_subject ON reports (guild_id, subject);
+CREATE INDEX IF NOT EXISTS reports_issuer ON reports (guild_id, issuer);
+CREATE TABLE IF NOT EXISTS report_sequences (
+	guild_id INTEGER PRIMARY KEY,
+	last_id INTEGER NOT NULL
+);
+"""
+
+# Make sure no sequence is behind the reports already stored (databases from before the
+# sequences existed, reports migrated from config.json)
+SYNC_SEQUENCES = """
+INSERT OR IGNORE INTO report_sequences (guild_id, last_id) SELECT DISTINCT guild_id, 0 FROM reports;
+UPDATE report_sequences SET last_id = MAX(last_id, (
+	SELECT COALESCE(MAX(report_id), 0) FROM reports WHERE reports.guild_id = report_sequences.guild_id
+));
+"""
+
+COLUMNS = 'report_id, action, body, issuer_id, issuer, subject_id, subject, created_at'
+
+
+class ReportStore:
+	"""Incident reports kept in an embedded SQLite database, indexed by guild,
+	report id and the user ids of the subject and issuer.
+
+	Reads run directly on the caller's connection. Every write runs on one dedicated
+	writer thread inside a BEGIN IMMEDIATE transaction, and report ids come from a
+	per guild sequence, so ids are never reused (not even after a recall) and
+	concurrent reports can not overwrite each other."""
+
+	def __init__(self, path='reports.db'):
+		self.path = path
+		self.db = self._connect()
+		self.db.execute('PRAGMA journal_mode=WAL')
+		self.db.executescript(SCHEMA)
+		self.db.executescript(SYNC_SEQUENCES)
+		self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='report-writer')
+		self._write_db = None
+
+	def _connect(self):
+		db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+		db.row_factory = sqlite3.Row
+		return db
+
+	def _transaction(self, function, *args):
+		# Runs on the writer thread, which owns its own connection
+		if self._write_db is None:
+			self._write_db = self._connect()
+		db = self._write_db
+		db.execute('BEGIN IMMEDIATE')
+		try:
+			result = function(db, *args)
+		except BaseException:
+			db.execute('ROLLBACK')
+			raise
+		db.execute('COMMIT')
+		return result
+
+	async def _write(self, function, *args):
+		return await asyncio.wrap_future(self._writer.submit(self._transaction, function, *args))
+
+	def _write_sync(self, function, *args):
+		return self._writer.submit(self._transaction, function, *args).result()
+
+	@staticmethod
+	def _allocate(db, guild_id, count):
+		db.execute('INSERT OR IGNORE INTO report_sequences (guild_id, last_id) VALUES (?, 0)', (guild_id,))
+		db.execute('UPDATE report_sequences SET last_id = last_id + ? WHERE guild_id = ?', (count, guild_id))
+		last = db.execute('SELECT last_id FROM report_sequences WHERE guild_id = ?', (guild_id,)).fetchone()[0]
+		return list(range(last - count + 1, last + 1))
+
+	@classmethod
+	def _insert_reports(cls, db, guild_id, reports):
+		ids = cls._allocate(db, guild_id, len(reports))
+		for report_id, report in zip(ids, reports):
+			report["report_id"] = report_id
+			db.execute(
+				f'INSERT INTO reports (guild_id, {COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+				(
+					guild_id, report_id, report["action"], report["body"],
+					report.get("issuer_id"), report["issuer"],
+					report.get("subject_id"), report["subject"],
+					report.get("created_at", datetime.utcnow().isoformat())
+				)
+			)
+		return ids
+
+	async def add(self, guild_id, report):
+		"""Store a report under the next id of the guild's sequence and return that id"""
+		return (await self._write(self._insert_reports, guild_id, [report]))[0]
+
+	async def add_many(self, guild_id, reports):
+		"""Insert reports in a single transaction, numbering them consecutively. Returns their ids"""
+		if not reports:
+			return []
+		return await self._write(self._insert_reports, guild_id, reports)
+
+	def get(self, guild_id, report_id):
+		row = self.db.execute(
+			f'SELECT {COLUMNS} FROM reports WHERE guild_id = ? AND report_id = ?', (guild_id, report_id)
+		).fetchone()
+		return dict(row) if row is not None else None
+
+	def _user_query(self, columns, guild_id, user_id, user_name, subject_only):
+		roles = ('subject',) if subject_only else ('subject', 'issuer')
+		queries = []
+		params = []
+		for role in roles:
+			queries.append(f'SELECT {columns} FROM reports WHERE guild_id = ? AND {role}_id = ?')
+			params += [guild_id, user_id]
+			if user_name is not None:
+				queries.append(
+					f'SELECT {columns} FROM reports WHERE guild_id = ? AND {role}_id IS NULL AND {role} = ?')
+				params += [guild_id, user_name]
+		return ' UNION '.join(queries), params
+
+	def by_user(self, guild_id, user_id, user_name=None, subject_only=False, limit=-1, offset=0):
+		"""Reports where the user is the subject (and the issuer, unless subject_only is set).
+		Reports migrated from config.json only carry a name#discriminator, so those are
+		matched by user_name"""
+		query, params = self._user_query(COLUMNS, guild_id, user_id, user_name, subject_only)
+		rows = self.db.execute(f'{query} ORDER BY report_id LIMIT ? OFFSET ?', params + [limit, offset]).fetchall()
+		return [dict(row) for row in rows]
+
+	def count_by_user(self, guild_id, user_id, user_name=None, subject_only=False):
+		query, params = self._user_query('report_id', guild_id, user_id, user_name, subject_only)
+		return self.db.execute(f'SELECT COUNT(*) FROM ({query})', params).fetchone()[0]
+
+	def has_legacy_reports(self, guild_id):
+		"""Whether the guild has migrated reports that can only be matched by name"""
+		row = self.db.execute(
+			'SELECT 1 FROM reports WHERE guild_id = ? AND (subject_id IS NULL OR issuer_id IS NULL) LIMIT 1',
+			(guild_id,)
+		).fetchone()
+		return row is not None
+
+	@staticmethod
+	def _delete(db, guild_id, report_id):
+		cursor = db.execute('DELETE FROM reports WHERE guild_id = ? AND report_id = ?', (guild_id, report_id))
+		return cursor.rowcount > 0
+
+	async def delete(self, guild_id, report_id):
+		return await self._write(self._delete, guild_id, report_id)
+
+	def migrate_from_config(self, config_store):
+		"""One-time import of the reports blobs that used to live in config.json"""
+		legacy = [
+			key for key, config in config_store.data.items() if isinstance(config, dict) and "reports" in config
+		]
+		migrated = self._write_sync(self._import_legacy, {key: config_store.data[key]["reports"] for key in legacy})
+		# Only drop the blobs once they are safely committed to the database. Every shard process
+		# migrates all guilds, so only the blobs are removed from the file and nothing else is written
+		config_store.remove_field("reports", legacy)
+		return migrated
+
+	@staticmethod
+	def _import_legacy(db, reports_by_guild):
+		migrated = 0
+		for key, reports in reports_by_guild.items():
+			for report in reports.values():
+				db.execute(
+					f'INSERT OR IGNORE INTO reports (guild_id, {COLUMNS}) VALUES (?, ?, ?, ?, NULL, ?, NULL, ?, NULL)',
+					(int(key), int(report["report_id"]), report["action"], report["body"],
+						report["issuer"], report["subject"])
+				)
+				migrated += 1
+		# executescript would commit the open transaction, run the statements one by one
+		for statement in SYNC_SEQUENCES.split(';'):
+			if statement.strip():
+				db.execute(statement)
+		return migrated
+
+	def close(self):
+		self._writer.shutdown(wait=True)
+		if self._write_db is not None:
+			self._write_db.close()
+		self.db.close()
@@ -0,0 +1,149 @@
+import asyncio
+from collections import Counter
+
+from utils import workers
+
+
+def pair_key(role_a, role_b):
+	return (role_a, role_b) if role_a < role_b else (role_b, role_a)
+
+
+def member_role_ids(member):
+	# The @everyone role shares the guild's id and is held by everybody, leave it out
+	return {role.id for role in member.roles if role.id != member.guild.id}
+
+
+class GuildRoleStats:
+	"""Member count of every role and of every pair of roles in a guild"""
+
+	def __init__(self):
+		self.counts = Counter()
+		self.pairs = Counter()
+
+	@classmethod
+	def from_counts(cls, role_ids, counts, pairs):
+		"""Statistics from index based counts and (row, col, count) pairs over role_ids in ascending order"""
+		stats = cls()
+		stats.counts = Counter(dict(zip(role_ids, counts)))
+		stats.pairs = Counter({(role_ids[row], role_ids[col]): count for row, col, count in pairs})
+		return stats
+
+	def add_member(self, role_ids):
+		self.update_member(set(), role_ids)
+
+	def remove_member(self, role_ids):
+		self.update_member(role_ids, set())
+
+	def update_member(self, before, after):
+		before, after = set(before), set(after)
+		held = set(before)
+		for role in before - after:
+			held.discard(role)
+			self.counts[role] -= 1
+			for other in held:
+				self._adjust_pair(role, other, -1)
+		for role in after - before:
+			for other in held:
+				self._adjust_pair(role, other, 1)
+			self.counts[role] += 1
+			held.add(role)
+
+	def _adjust_pair(self, role_a, role_b, amount):
+		key = pair_key(role_a, role_b)
+		self.pairs[key] += amount
+		if not self.pairs[key]:
+			del self.pairs[key]
+
+	def add_role(self, role_id):
+		self.counts.setdefault(role_id, 0)
+
+	def remove_role(self, role_id):
+		self.counts.pop(role_id, None)
+		for key in [key for key in self.pairs if role_id in key]:
+			del self.pairs[key]
+
+	def co_occurrence(self, role_ids):
+		"""Counts and pair counts for the given role order, as plain index based lists"""
+		index = {role_id: i for i, role_id in enumerate(role_ids)}
+		counts = [self.counts.get(role_id, 0) for role_id in role_ids]
+		# Sorted so identical state always produces identical input (and chart cache key)
+		pairs = sorted(
+			(index[role_a], index[role_b], count)
+			for (role_a, role_b), count in self.pairs.items()
+			if role_a in index and role_b in index
+		)
+		return counts, pairs
+
+
+class RoleStatsIndex:
+	"""Per guild role statistics, built once and then kept current from gateway events.
+
+	A build snapshots every member's roles on the event loop and counts the roles
+	and role pairs in the executor from the sparse product A.T @ A (see
+	utils.cooccurrence). Events arriving meanwhile are queued and replayed on the
+	result, the snapshot was taken before any of them."""
+
+	def __init__(self, executor=None):
+		self.executor = executor
+		self.guilds = {}
+		self.building = {}
+		self.pending = {}
+
+	async def build(self, guild):
+		# Concurrent builds of one guild (e.g. on_ready after a reconnect) share the running one
+		if guild.id not in self.building:
+			self.building[guild.id] = asyncio.ensure_future(self._build(guild))
+		return await asyncio.shield(self.building[guild.id])
+
+	async def _build(self, guild):
+		role_ids = sorted(role.id for role in guild.roles if not role.is_default())
+		index = {role_id: i for i, role_id in enumerate(role_ids)}
+		# The only part on the event loop, a single linear pass (@everyone is not in the index)
+		member_roles = [[index[role.id] for role in member.roles if role.id in index] for member in guild.members]
+		pending = self.pending[guild.id] = []
+		try:
+			counts, pairs = await asyncio.get_running_loop().run_in_executor(
+				self.executor, workers.run, 'utils.cooccurrence', 'role_counts', member_roles, len(role_ids))
+		finally:
+			del self.building[guild.id]
+			dropped = self.pending.pop(guild.id, None) is not pending
+		stats = GuildRoleStats.from_counts(role_ids, counts, pairs)
+		for event in pending:
+			event(stats)
+		if not dropped:
+			self.guilds[guild.id] = stats
+		return stats
+
+	async def get(self, guild):
+		stats = self.guilds.get(guild.id)
+		return stats if stats is not None else await self.build(guild)
+
+	def drop(self, guild):
+		self.guilds.pop(guild.id, None)
+		self.pending.pop(guild.id, None)
+
+	def _apply(self, guild_id, event):
+		# Events for guilds that are not indexed or being built are ignored, the build picks up their state
+		stats = self.guilds.get(guild_id)
+		if stats is not None:
+			event(stats)
+		if guild_id in self.pending:
+			self.pending[guild_id].append(event)
+
+	def member_joined(self, member):
+		role_ids = member_role_ids(member)
+		self._apply(member.guild.id, lambda stats: stats.add_member(role_ids))
+
+	def member_left(self, member):
+		role_ids = member_role_ids(member)
+		self._apply(member.guild.id, lambda stats: stats.remove_member(role_ids))
+
+	def member_updated(self, before, after):
+		before_ids, after_ids = member_role_ids(before), member_role_ids(after)
+		self._apply(after.guild.id, lambda stats: stats.update_member(before_ids, after_ids))
+
+	def role_created(self, role):
+		self._apply(role.guild.id, lambda stats: stats.add_role(role.id))
+
+	def role_deleted(self, role):
+		self._apply(role.guild.id, lambda stats: stats.remove_role(role.id))
@@ -0,0 +1,105 @@
+import asyncio
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+
+from discord.ext import commands
+
+
+class QueueFull(commands.CommandError):
+	pass
+
+
+class Scheduler:
+	"""Coordination shared by all cogs: a lock per guild for read-modify-write of guild
+	state, and a limited number of slots for expensive jobs.
+
+	A guild runs at most per_guild jobs at once. Further jobs are queued per guild
+	and free slots are handed out round robin across the guilds below their cap,
+	so one busy guild can not starve the others."""
+
+	def __init__(self, workers=4, queue_limit=5, per_guild=1):
+		self.workers = workers
+		self.queue_limit = queue_limit
+		self.per_guild = per_guild
+		self.running = 0
+		self.running_by_guild = defaultdict(int)
+		self.queues = OrderedDict()
+		self.guild_locks = defaultdict(asyncio.Lock)
+
+	def guild_lock(self, guild_id):
+		return self.guild_locks[guild_id]
+
+	@property
+	def queued(self):
+		return sum(len(queue) for queue in self.queues.values())
+
+	@asynccontextmanager
+	async def heavy(self, guild_id):
+		"""Hold one of the expensive job slots for the duration of the block"""
+		if self.running < self.workers and self.running_by_guild.get(guild_id, 0) < self.per_guild \
+				and guild_id not in self.queues:
+			self._start(guild_id)
+		else:
+			queue = self.queues.setdefault(guild_id, deque())
+			if len(queue) >= self.queue_limit:
+				if not queue:
+					del self.queues[guild_id]
+				raise QueueFull('This server already has too many jobs queued, please try again later')
+			future = asyncio.get_running_loop().create_future()
+			queue.append(future)
+			try:
+				await future
+			except asyncio.CancelledError:
+				if future.done() and not future.cancelled():
+					# The slot was handed over just as we were cancelled, pass it on
+					self._release(guild_id)
+				else:
+					self._forget(guild_id, future)
+				raise
+		try:
+			yield
+		finally:
+			self._release(guild_id)
+
+	def _start(self, guild_id):
+		self.running += 1
+		self.running_by_guild[guild_id] += 1
+
+	def _forget(self, guild_id, future):
+		queue = self.queues.get(guild_id)
+		if queue is not None and future in queue:
+			queue.remove(future)
+			if not queue:
+				del self.queues[guild_id]
+
+	def _release(self, guild_id):
+		self.running -= 1
+		self.running_by_guild[guild_id] -= 1
+		if not self.running_by_guild[guild_id]:
+			del self.running_by_guild[guild_id]
+		# The guild that just had its turn waits behind the others
+		if guild_id in self.queues:
+			self.queues.move_to_end(guild_id)
+		self._dispatch()
+
+	def _dispatch(self):
+		# Start waiting jobs while slots are free, guilds at their cap keep their place in line.
+		# A guild that got a slot moves to the back
+		started = True
+		while started and self.running < self.workers:
+			started = False
+			for guild_id in list(self.queues):
+				if self.running >= self.workers:
+					return
+				if self.running_by_guild.get(guild_id, 0) >= self.per_guild:
+					continue
+				queue = self.queues.pop(guild_id)
+				while queue:
+					future = queue.popleft()
+					if not future.done():
+						self._start(guild_id)
+						future.set_result(None)
+						started = True
+						break
+				if queue:
+					self.queues[guild_id] = queue
@@ -0,0 +1,66 @@
+from time import monotonic
+
+
+class UnverifiedGate:
+	"""Ids of the members holding each guild's verification role, kept current from
+	member events so gating a message is a single set lookup"""
+
+	def __init__(self, store, notice_cooldown=60):
+		self.store = store
+		self.notice_cooldown = notice_cooldown
+		self.members = {}
+		self.last_notice = {}
+
+	def role_id(self, guild):
+		return self.store.guild(guild.id)["verification_role"]
+
+	def build(self, guild):
+		role = guild.get_role(self.role_id(guild)) if self.role_id(guild) is not None else None
+		self.members[guild.id] = {member.id for member in role.members} if role is not None else set()
+
+	def reset(self, guild):
+		self.members[guild.id] = set()
+
+	def drop(self, guild):
+		self.members.pop(guild.id, None)
+
+	def is_gated(self, guild_id, user_id):
+		members = self.members.get(guild_id)
+		return members is not None and user_id in members
+
+	def blocks(self, message, bot_user):
+		"""Whether a guild message has to be removed because its author has not verified yet.
+		Messages in the verification channel and the verify command itself get through"""
+		# Common case (verified member) is a single set lookup
+		if message.author == bot_user or not self.is_gated(message.guild.id, message.author.id):
+			return False
+		verify_channel = self.store.guild(message.guild.id)['verification_channel']
+		return message.channel.id != verify_channel and message.content != "b!verify"
+
+	def add(self, member):
+		self.members.setdefault(member.guild.id, set()).add(member.id)
+
+	def remove(self, member):
+		self.members.get(member.guild.id, set()).discard(member.id)
+
+	def member_updated(self, before, after):
+		role_id = self.role_id(after.guild)
+		if role_id is None:
+			return
+		if any(role.id == role_id for role in after.roles):
+			self.add(after)
+		else:
+			self.remove(after)
+
+	def should_notify(self, user_id):
+		"""Rate limit the 'you have not verified' DM to one per cooldown per user"""
+		now = monotonic()
+		if now - self.last_notice.get(user_id, float('-inf')) < self.notice_cooldown:
+			return False
+		self.last_notice[user_id] = now
+		# Forget users whose cooldown has long passed so the dict does not grow forever
+		if len(self.last_notice) > 10000:
+			self.last_notice = {
+				user: sent for user, sent in self.last_notice.items() if now - sent < self.notice_cooldown
+			}
+		return True
@@ -0,0 +1,50 @@
+import asyncio
+from time import monotonic
+
+
+class VerificationSessions:
+	"""Pending verifications keyed by (user id, DM channel id).
+
+	Incoming DMs are routed to their session with a single dict lookup instead of
+	every pending verify registering its own check on every message."""
+
+	def __init__(self):
+		self.sessions = {}
+		self.completed = 0
+		self.timeouts = 0
+
+	@property
+	def in_flight(self):
+		return len(self.sessions)
+
+	def dispatch(self, message):
+		"""Route a DM to its pending session, returns True if it answered one"""
+		session = self.sessions.get((message.author.id, message.channel.id))
+		if session is None:
+			return False
+		answer, future, expires = session
+		if future.done() or monotonic() > expires or message.content != answer:
+			return False
+		future.set_result(message)
+		return True
+
+	async def wait(self, user_id, channel_id, answer, timeout):
+		"""Wait up to timeout seconds for the user to send the answer in the channel"""
+		key = (user_id, channel_id)
+		previous = self.sessions.get(key)
+		if previous is not None:
+			# Rerunning verify replaces the old challenge
+			previous[1].cancel()
+		future = asyncio.get_running_loop().create_future()
+		session = (answer, future, monotonic() + timeout)
+		self.sessions[key] = session
+		try:
+			result = await asyncio.wait_for(future, timeout)
+			self.completed += 1
+			return result
+		except asyncio.TimeoutError:
+			self.timeouts += 1
+			raise
+		finally:
+			if self.sessions.get(key) is session:
+				del self.sessions[key]
@@ -0,0 +1,61 @@
+import asyncio
+import os
+from time import monotonic
+
+
+class TextAsset:
+	"""Contents of a text file kept in memory, reloaded when the file's modification time
+	changes. The file is stat'ed at most once every check_interval seconds"""
+
+	def __init__(self, path, check_interval=5.0):
+		self.path = path
+		self.check_interval = check_interval
+		self.text = None
+		self.mtime = None
+		self.checked = float('-inf')
+
+	def read(self):
+		now = monotonic()
+		if now - self.checked >= self.check_interval:
+			self.checked = now
+			mtime = os.stat(self.path).st_mtime
+			if mtime != self.mtime:
+				with open(self.path) as file:
+					self.text = file.read()
+				self.mtime = mtime
+		return self.text
+
+
+class JoinCoalescer:
+	"""Collapses welcome posts during join bursts.
+
+	The first join of a guild is posted straight away and opens a window. Joins during
+	the window are collected and posted together when it closes, as one batch if
+	there was more than one, after which a new window opens for as long as joins keep coming."""
+
+	def __init__(self, window=5.0):
+		self.window = window
+		self.pending = {}
+
+	async def joined(self, member, send):
+		"""send is a coroutine function taking the guild and the list of members to welcome"""
+		guild = member.guild
+		if guild.id in self.pending:
+			self.pending[guild.id].append(member)
+			return
+		self.pending[guild.id] = []
+		asyncio.get_running_loop().create_task(self._close_window(guild, send))
+		await send(guild, [member])
+
+	async def _close_window(self, guild, send):
+		while True:
+			await asyncio.sleep(self.window)
+			members = self.pending[guild.id]
+			if not members:
+				del self.pending[guild.id]
+				return
+			self.pending[guild.id] = []
+			try:
+				await send(guild, members)
+			except Exception as error:
+				print(f'Failed to post welcome batch in {guild}: {error}')
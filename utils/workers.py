@@ -0,0 +1,10 @@
+"""Entry point for process pool jobs.
+
+The bot process only references jobs by module and function name, so the
+scientific stack behind them (numpy, scipy, matplotlib, networkx) is imported
+inside the worker on its first job and never in the bot process itself."""
+from importlib import import_module
+
+
+def run(module, function, *args):
+	return getattr(import_module(module), function)(*args)